@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Per-tenant, per-day rollups of message volume, intents and NLU fallbacks.
+
+    python analytics.py rebuild [--since 2024-01-01] [--batch-size 5000] [--sleep 0]
+
+`message_daily` counts the user and bot messages of each tenant and day, and
+how many user messages got an intent and how many of those were fallbacks;
+`intent_daily` counts each intent with the sum of its confidences. Both are
+updated in the transaction that stores the messages, so GET /analytics reads
+a few rows per day and never scans `messages`. The counters outlive messages
+moved to the archive by retention.py.
+
+`rebuild` recounts the days from --since on (all days by default) from the
+messages still in the database. The old counters are replaced in a single
+transaction at the end, so /analytics keeps serving them until then and a
+failed rebuild leaves them as they were. Days whose messages were archived
+would lose their counts, so keep --since after the archive horizon.
+"""
+
+import argparse
+import logging
+from datetime import date, datetime, time
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+logger = logging.getLogger('analytics')
+
+_UPSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+class Rollups:
+    """Keeps the daily message and intent counters in step with the messages being stored.
+
+    A classified user message counts as a fallback when its intent is one of
+    `fallback_intents` or its confidence is below `fallback_confidence`.
+    """
+
+    def __init__(self, conversation_model, message_daily_model, intent_daily_model,
+                 fallback_intents=('nlu_fallback',), fallback_confidence=0.3):
+        self.Conversation = conversation_model
+        self.MessageDaily = message_daily_model
+        self.IntentDaily = intent_daily_model
+        self.fallback_intents = frozenset(fallback_intents)
+        self.fallback_confidence = fallback_confidence
+
+    def is_fallback(self, intent, confidence):
+        return intent in self.fallback_intents or (confidence is not None and confidence < self.fallback_confidence)
+
+    def record(self, session, rows, messages=True):
+        """Add message rows (dicts with conversation_id, sender, created_at, intent, confidence) to the counters"""
+        if not rows:
+            return
+        days = {}
+        intents = {}
+        self._count(session, rows, days, intents, messages)
+        self._increment(session, self.MessageDaily.__table__, ('tenant_id', 'day'), days)
+        self._increment(session, self.IntentDaily.__table__, ('tenant_id', 'day', 'intent'), intents)
+
+    def record_intents(self, session, rows):
+        """Add the intents of user messages that were counted by record() before they had one"""
+        self.record(session, rows, messages=False)
+
+    def _count(self, session, rows, days, intents, messages=True):
+        """Add the counts of message rows to the `days` and `intents` dicts, keyed like the rollup tables;
+        `messages=False` leaves the message counts alone and only adds the intents"""
+        if not rows:
+            return
+        tenants = dict(
+            session.query(self.Conversation.id, self.Conversation.tenant_id)
+            .filter(self.Conversation.id.in_({row['conversation_id'] for row in rows}))
+        )
+        for row in rows:
+            tenant_pk = tenants.get(row['conversation_id'])
+            if tenant_pk is None:
+                continue
+            key = (tenant_pk, row['created_at'].date())
+            counts = days.setdefault(key, {'user_messages': 0, 'bot_messages': 0, 'classified': 0, 'fallbacks': 0})
+            if row['sender'] != 'user':
+                counts['bot_messages'] += messages
+                continue
+            counts['user_messages'] += messages
+            intent, confidence = row.get('intent'), row.get('confidence')
+            if not intent:
+                continue
+            counts['classified'] += 1
+            counts['fallbacks'] += self.is_fallback(intent, confidence)
+            entry = intents.setdefault(key + (intent,), {'messages': 0, 'scored': 0, 'confidence_sum': 0.0})
+            entry['messages'] += 1
+            if confidence is not None:
+                entry['scored'] += 1
+                entry['confidence_sum'] += confidence
+
+    def _increment(self, session, table, keys, counters):
+        if not counters:
+            return
+        # A fixed order keeps concurrent writers from locking the same rows in opposite orders
+        rows = [dict(zip(keys, key), **counts) for key, counts in sorted(counters.items())]
+        upsert = _UPSERTS.get(session.get_bind().dialect.name)
+        if upsert is not None:
+            statement = upsert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={name: table.c[name] + statement.excluded[name] for name in rows[0] if name not in keys}
+            )
+            session.execute(statement, rows)
+            return
+        for row in rows:
+            updated = session.execute(
+                update(table)
+                .where(*(table.c[key] == row[key] for key in keys))
+                .values({name: table.c[name] + value for name, value in row.items() if name not in keys})
+            ).rowcount
+            if not updated:
+                session.execute(insert(table).values(row))
+
+    def report(self, session, tenant_pk, first_day, last_day):
+        """Daily volume and fallback rate and the intent distribution of one tenant, first_day to last_day inclusive"""
+        MessageDaily, IntentDaily = self.MessageDaily, self.IntentDaily
+        days = session.query(
+            MessageDaily.day, MessageDaily.user_messages, MessageDaily.bot_messages,
+            MessageDaily.classified, MessageDaily.fallbacks
+        ).filter(
+            MessageDaily.tenant_id == tenant_pk, MessageDaily.day.between(first_day, last_day)
+        ).order_by(MessageDaily.day).all()
+        intents = session.query(
+            IntentDaily.intent, func.sum(IntentDaily.messages), func.sum(IntentDaily.scored),
+            func.sum(IntentDaily.confidence_sum)
+        ).filter(
+            IntentDaily.tenant_id == tenant_pk, IntentDaily.day.between(first_day, last_day)
+        ).group_by(IntentDaily.intent).all()
+
+        totals = {'user_messages': 0, 'bot_messages': 0, 'classified': 0, 'fallbacks': 0}
+        daily = []
+        for row in days:
+            for name in totals:
+                totals[name] += getattr(row, name)
+            daily.append({
+                'day': row.day,
+                'messages': row.user_messages + row.bot_messages,
+                'user_messages': row.user_messages,
+                'bot_messages': row.bot_messages,
+                'classified': row.classified,
+                'fallbacks': row.fallbacks,
+                'fallback_rate': _rate(row.fallbacks, row.classified)
+            })
+        totals['messages'] = totals['user_messages'] + totals['bot_messages']
+        totals['fallback_rate'] = _rate(totals['fallbacks'], totals['classified'])
+
+        distribution = [{
+            'intent': intent,
+            'messages': messages,
+            'share': _rate(messages, totals['classified']),
+            'average_confidence': round(confidence_sum / scored, 4) if scored else None
+        } for intent, messages, scored, confidence_sum in intents]
+        distribution.sort(key=lambda entry: (-entry['messages'], entry['intent']))
+
+        return {'from': first_day, 'to': last_day, 'totals': totals, 'days': daily, 'intents': distribution}
+
+    def rebuild(self, session_factory, message_model, since, batch_size, budget):
+        """Recount the days from `since` (a date, or None for all) from stored messages.
+
+        Messages are counted in memory one batch at a time; the counters are
+        only replaced, in one transaction, once every batch has been read.
+        """
+        Message = message_model
+        columns = (Message.id, Message.conversation_id, Message.sender, Message.intent, Message.confidence,
+                   Message.created_at)
+
+        def messages_after(session, after_id, last_id=None):
+            query = session.query(*columns).filter(Message.id > after_id)
+            if last_id is not None:
+                query = query.filter(Message.id <= last_id)
+            if since is not None:
+                query = query.filter(Message.created_at >= datetime.combine(since, time.min))
+            return query.order_by(Message.id)
+
+        session = session_factory()
+        try:
+            last_id = session.query(func.max(Message.id)).scalar() or 0
+        finally:
+            session.close()
+
+        days = {}
+        intents = {}
+        counted = 0
+        after_id = 0
+        while after_id < last_id:
+            session = session_factory()
+            try:
+                rows = [row._asdict() for row in messages_after(session, after_id, last_id).limit(batch_size)]
+                if not rows:
+                    break
+                self._count(session, rows, days, intents)
+            finally:
+                session.close()
+            counted += len(rows)
+            after_id = rows[-1]['id']
+            budget.pause()
+
+        session = session_factory()
+        try:
+            # Deleting first takes the SQLite write lock, so no writer commits between the delete and
+            # counting the messages stored since `last_id`, whose writers have already added them
+            for model in (self.MessageDaily, self.IntentDaily):
+                query = session.query(model)
+                if since is not None:
+                    query = query.filter(model.day >= since)
+                query.delete(synchronize_session=False)
+            rows = [row._asdict() for row in messages_after(session, last_id)]
+            self._count(session, rows, days, intents)
+            counted += len(rows)
+            self._increment(session, self.MessageDaily.__table__, ('tenant_id', 'day'), days)
+            self._increment(session, self.IntentDaily.__table__, ('tenant_id', 'day', 'intent'), intents)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return counted
+
+
+def main():
+    from retention import Budget
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = commands.add_parser('rebuild', help='recount the daily rollups from the stored messages')
+    rebuild_parser.add_argument('--since', type=date.fromisoformat, help='first day to recount (YYYY-MM-DD)')
+    rebuild_parser.add_argument('--batch-size', type=int, default=5000)
+    rebuild_parser.add_argument('--sleep', type=float, default=0.0, help='pause between batches, in seconds')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    import app as api
+    api.init_db()
+    counted = api.rollups.rebuild(api.Session, api.Message, args.since, args.batch_size, Budget(None, args.sleep))
+    logger.info(f"Counted {counted} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,118 @@
 import os
+import hmac
 import json
+import uuid
+import queue
+import time
+import atexit
+import signal
 import logging
-import requests
 import jwt
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from werkzeug.security import check_password_hash
+from sqlalchemy import func, select, Column, Integer, Float, String, Text, Date, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-import pandas as pd
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("logs/api.log"),
-        logging.StreamHandler()
-    ]
-)
+from auth_cache import CredentialCache, TenantContext, TokenRevocations, tenant_version
+from rasa_client import RasaClient, RasaError, RasaUnavailable
+from message_writer import MessageWriter, insert_returning
+from pagination import (decode_cursor, decode_rank_cursor, encode_rank_cursor, keyset_after, paginate,
+                        parse_limit, parse_timestamp)
+from export import iter_csv, iter_ndjson, gzip_stream
+from archive import iter_archive, merge_by_id
+from tenant_manager import TenantManager
+from storage import add_missing_columns, convert_column_type, dispose_engines, get_engine
+from persian import normalize_text
+from reply_cache import ReplyCache, sample_nlu_examples
+from metrics import Metrics
+from rate_limit import FairAdmission, RateLimiter, RateLimitExceeded, create_bucket_store
+from reply_jobs import JOB_DONE, JOB_FAILED, JOB_PENDING, JOB_RUNNING, JobQueue, deliver_callback
+from pubsub import MessageBroker, format_event, serialize_message
+from json_provider import create_json_provider
+from analytics import Rollups
+import search
+
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+# orjson when installed; datetimes are encoded as ISO-8601 and Farsi text as raw UTF-8
+app.json = create_json_provider(app)
 
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_secret_key')
+# One Rasa URL, or several replicas separated by commas
 app.config['RASA_URL'] = os.environ.get('RASA_URL', 'http://rasa:5005')
 app.config['DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///data/chatbot.db')
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 300))
+app.config['AUTH_CACHE_SIZE'] = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+app.config['RASA_CONNECT_TIMEOUT'] = float(os.environ.get('RASA_CONNECT_TIMEOUT', 2))
+app.config['RASA_READ_TIMEOUT'] = float(os.environ.get('RASA_READ_TIMEOUT', 30))
+app.config['RASA_MAX_CONCURRENCY'] = int(os.environ.get('RASA_MAX_CONCURRENCY', 32))
+app.config['RASA_RETRIES'] = int(os.environ.get('RASA_RETRIES', 2))
+app.config['RASA_BREAKER_THRESHOLD'] = int(os.environ.get('RASA_BREAKER_THRESHOLD', 5))
+app.config['RASA_BREAKER_RESET'] = float(os.environ.get('RASA_BREAKER_RESET', 30))
+# Seconds between /status probes of each replica; 0 turns off health checks and warm-up
+app.config['RASA_HEALTH_INTERVAL'] = float(os.environ.get('RASA_HEALTH_INTERVAL', 5))
+# A sender leaves its replica when that one has more than this times the average load; 0 = never
+app.config['RASA_LOAD_FACTOR'] = float(os.environ.get('RASA_LOAD_FACTOR', 1.25))
+# Training examples from NLU_FILE parsed by each replica before it takes traffic
+app.config['RASA_WARMUP_MESSAGES'] = int(os.environ.get('RASA_WARMUP_MESSAGES', 20))
+# 'group' = write-behind batched commits, 'sync' = commit inside the request
+app.config['MESSAGE_DURABILITY'] = os.environ.get('MESSAGE_DURABILITY', 'group')
+app.config['MESSAGE_BATCH_SIZE'] = int(os.environ.get('MESSAGE_BATCH_SIZE', 200))
+app.config['MESSAGE_FLUSH_INTERVAL'] = float(os.environ.get('MESSAGE_FLUSH_INTERVAL', 0.05))
+app.config['MESSAGE_QUEUE_SIZE'] = int(os.environ.get('MESSAGE_QUEUE_SIZE', 10000))
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 50))
+app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 500))
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+# Gzipped NDJSON segments written by `retention.py run`; /export?archive=1 reads them
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', 'data/archive')
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 100))
+app.config['BATCH_RASA_PARALLELISM'] = int(os.environ.get('BATCH_RASA_PARALLELISM', 8))
+# Opt-in cache of Rasa replies for intents a tenant lists in its 'stateless_intents' setting
+app.config['REPLY_CACHE_ENABLED'] = os.environ.get('REPLY_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+app.config['REPLY_CACHE_TTL'] = float(os.environ.get('REPLY_CACHE_TTL', 3600))
+app.config['REPLY_CACHE_SIZE'] = int(os.environ.get('REPLY_CACHE_SIZE', 10000))
+app.config['NLU_FILE'] = os.environ.get('NLU_FILE', 'rasa_data/nlu.yml')
+# Intent and confidence of user messages from Rasa's /model/parse, called beside the reply
+app.config['INTENT_CAPTURE_ENABLED'] = os.environ.get('INTENT_CAPTURE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['INTENT_CAPTURE_TIMEOUT'] = float(os.environ.get('INTENT_CAPTURE_TIMEOUT', 1.0))
+# A classified message is a fallback when its intent is listed here or its confidence is lower
+app.config['FALLBACK_INTENTS'] = [intent.strip() for intent in os.environ.get('FALLBACK_INTENTS', 'nlu_fallback').split(',') if intent.strip()]
+app.config['FALLBACK_CONFIDENCE'] = float(os.environ.get('FALLBACK_CONFIDENCE', 0.3))
+app.config['ANALYTICS_DEFAULT_DAYS'] = int(os.environ.get('ANALYTICS_DEFAULT_DAYS', 30))
+app.config['ANALYTICS_MAX_DAYS'] = int(os.environ.get('ANALYTICS_MAX_DAYS', 366))
+app.config['SLOW_REQUEST_THRESHOLD'] = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 1.0))
+app.config['SLOW_REQUEST_SAMPLE_RATE'] = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 0.1))
+# Bearer token required by /metrics and the detailed /health; unset leaves them open
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None
+# Break metrics and /health stats down by tenant ID; off aggregates them over all tenants
+app.config['METRICS_TENANT_LABELS'] = os.environ.get('METRICS_TENANT_LABELS', 'false').lower() in ('1', 'true', 'yes')
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_PER_SECOND'] = float(os.environ.get('RATE_LIMIT_PER_SECOND', 10))
+app.config['RATE_LIMIT_BURST'] = float(os.environ.get('RATE_LIMIT_BURST', 20))
+app.config['RASA_TENANT_WEIGHT'] = float(os.environ.get('RASA_TENANT_WEIGHT', 1))
+app.config['RASA_QUEUE_TIMEOUT'] = float(os.environ.get('RASA_QUEUE_TIMEOUT', 0.5))
+app.config['ASYNC_REPLY_WORKERS'] = int(os.environ.get('ASYNC_REPLY_WORKERS', 8))
+app.config['ASYNC_REPLY_QUEUE_SIZE'] = int(os.environ.get('ASYNC_REPLY_QUEUE_SIZE', 1000))
+app.config['ASYNC_REPLY_MAX_WAIT'] = float(os.environ.get('ASYNC_REPLY_MAX_WAIT', 30))
+# A job still running after this many seconds was lost with its process and is marked failed at startup
+app.config['ASYNC_REPLY_STALE_AFTER'] = float(os.environ.get('ASYNC_REPLY_STALE_AFTER', 300))
+app.config['CALLBACK_TIMEOUT'] = float(os.environ.get('CALLBACK_TIMEOUT', 5))
+app.config['CALLBACK_RETRIES'] = int(os.environ.get('CALLBACK_RETRIES', 2))
+app.config['SSE_HEARTBEAT'] = float(os.environ.get('SSE_HEARTBEAT', 15))
+app.config['SSE_MAX_PENDING'] = int(os.environ.get('SSE_MAX_PENDING', 1000))
+app.config['TENANTS_FILE'] = os.environ.get('TENANTS_FILE', 'data/tenants.csv')
+# Sync the tenants file into the database when the preloading server master or the development server
+# starts; request handlers and workers only read the tenants table
+app.config['TENANTS_AUTOLOAD'] = os.environ.get('TENANTS_AUTOLOAD', 'true').lower() in ('1', 'true', 'yes')
+# Seconds between checks of the tenants table for changes; 0 disables hot reload
+app.config['TENANTS_RELOAD_INTERVAL'] = float(os.environ.get('TENANTS_RELOAD_INTERVAL', 5))
 
 # Initialize SQLAlchemy
 Base = declarative_base()
@@ -38,30 +120,44 @@ Base = declarative_base()
 # Define SQLAlchemy models
 class Tenant(Base):
     __tablename__ = 'tenants'
+    __table_args__ = (
+        Index('ix_tenants_updated', 'updated_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     tenant_id = Column(String(50), unique=True, nullable=False)
     name = Column(String(100), nullable=False)
     api_key = Column(String(100), nullable=False)
+    # SHA-256 of the API key, so provisioning can detect key changes without re-running PBKDF2
+    key_fingerprint = Column(String(64), nullable=True)
     config = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set by every provisioning write, so server processes notice changes with one indexed query
+    updated_at = Column(DateTime, nullable=True)
     
     conversations = relationship("Conversation", back_populates="tenant")
     
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_tenant_user', 'tenant_id', 'user_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(String(100), nullable=False)
     tenant_id = Column(Integer, ForeignKey('tenants.id'))
     name = Column(String(100), nullable=True)
-    metadata = Column(Text, nullable=True)
+    # 'metadata' is reserved by the declarative API, so map the column under another name
+    user_metadata = Column('metadata', Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     conversations = relationship("Conversation", back_populates="user")
     
 class Conversation(Base):
     __tablename__ = 'conversations'
+    __table_args__ = (
+        Index('ix_conversations_tenant_updated', 'tenant_id', 'updated_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(String(100), unique=True, nullable=False)
@@ -77,54 +173,502 @@ class Conversation(Base):
     
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_conversation_created', 'conversation_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'))
     sender = Column(String(10), nullable=False)  # 'user' or 'bot'
     content = Column(Text, nullable=False)
     intent = Column(String(100), nullable=True)
-    confidence = Column(String(20), nullable=True)
+    confidence = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     conversation = relationship("Conversation", back_populates="messages")
 
-# Create database engine and tables
-engine = create_engine(app.config['DATABASE_URI'])
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+# Daily rollups kept up to date by every message write (see analytics.py)
+class MessageDaily(Base):
+    __tablename__ = 'message_daily'
+    
+    tenant_id = Column(Integer, ForeignKey('tenants.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    user_messages = Column(Integer, nullable=False, default=0)
+    bot_messages = Column(Integer, nullable=False, default=0)
+    classified = Column(Integer, nullable=False, default=0)  # user messages with an intent
+    fallbacks = Column(Integer, nullable=False, default=0)
 
-# Load tenant configurations from CSV
-def load_tenants():
-    try:
-        tenant_file = 'data/tenants.csv'
-        if os.path.exists(tenant_file):
-            df = pd.read_csv(tenant_file)
-            
-            session = Session()
-            for _, row in df.iterrows():
-                tenant = session.query(Tenant).filter_by(tenant_id=row['tenant_id']).first()
-                if not tenant:
-                    tenant = Tenant(
-                        tenant_id=row['tenant_id'],
-                        name=row['name'],
-                        api_key=generate_password_hash(row['api_key']),
-                        config=row.get('config', '{}')
-                    )
-                    session.add(tenant)
-            
-            session.commit()
+class IntentDaily(Base):
+    __tablename__ = 'intent_daily'
+    
+    tenant_id = Column(Integer, ForeignKey('tenants.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    intent = Column(String(100), primary_key=True)
+    messages = Column(Integer, nullable=False, default=0)
+    scored = Column(Integer, nullable=False, default=0)  # messages with a confidence
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+
+class ReplyJob(Base):
+    __tablename__ = 'reply_jobs'
+    
+    id = Column(String(32), primary_key=True)
+    tenant_id = Column(Integer, ForeignKey('tenants.id'), nullable=False)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
+    sender_id = Column(String(100), nullable=False)
+    message = Column(Text, nullable=False)
+    status = Column(String(10), default=JOB_PENDING)  # 'pending', 'running', 'done' or 'failed'
+    responses = Column(Text, nullable=True)
+    error = Column(String(200), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+# Columns returned by the message listing, selected as plain rows rather than ORM objects
+MESSAGE_COLUMNS = (Message.id, Message.sender, Message.content, Message.intent, Message.confidence, Message.created_at)
+
+# Database engine (WAL/PRAGMA-tuned SQLite or pooled Postgres, see storage.py); created and bound
+# to Session by init_engine, so importing this module opens nothing
+engine = None
+Session = sessionmaker()
+# Set by init_db once the FTS5 index exists
+search_enabled = False
+
+# Request/stage latency histograms and per-request SQL query counts, exposed on /metrics
+metrics = Metrics(
+    slow_request_threshold=app.config['SLOW_REQUEST_THRESHOLD'],
+    slow_request_sample_rate=app.config['SLOW_REQUEST_SAMPLE_RATE'],
+    tenant_labels=app.config['METRICS_TENANT_LABELS']
+)
+metrics.init_app(app)
+
+# Cache of verified API keys so repeat authentications skip the DB and the password hash
+credential_cache = CredentialCache(
+    app.config['SECRET_KEY'],
+    ttl=app.config['AUTH_CACHE_TTL'],
+    max_size=app.config['AUTH_CACHE_SIZE']
+)
+
+def load_tenant_version(tenant_pk):
+    """Current version of a tenant from its tenants row, or None when the tenant does not exist"""
+    with metrics.stage('db_lookup'):
+        session = Session()
+        try:
+            row = session.query(Tenant.api_key, Tenant.config).filter_by(id=tenant_pk).first()
+        finally:
             session.close()
-            logger.info("Tenants loaded successfully")
+    return tenant_version(row.api_key, row.config) if row else None
+
+# Current key/config version of every tenant, used to reject tokens issued before a rotation;
+# tenants this process has not loaded yet are read from the database on first use
+token_revocations = TokenRevocations(loader=load_tenant_version)
+
+def rasa_warmup_messages():
+    return sample_nlu_examples(app.config['NLU_FILE'], app.config['RASA_WARMUP_MESSAGES'])
+
+# Shared Rasa client: pooled connections, deadlines, concurrency limit and circuit breakers,
+# balanced over the Rasa replicas with sticky senders, health checks and warm-up
+rasa_client = RasaClient(
+    app.config['RASA_URL'],
+    connect_timeout=app.config['RASA_CONNECT_TIMEOUT'],
+    read_timeout=app.config['RASA_READ_TIMEOUT'],
+    max_concurrency=app.config['RASA_MAX_CONCURRENCY'],
+    retries=app.config['RASA_RETRIES'],
+    failure_threshold=app.config['RASA_BREAKER_THRESHOLD'],
+    reset_timeout=app.config['RASA_BREAKER_RESET'],
+    health_interval=app.config['RASA_HEALTH_INTERVAL'],
+    load_factor=app.config['RASA_LOAD_FACTOR'],
+    warmup_messages=rasa_warmup_messages
+)
+
+def current_model_id():
+    """Identifier of the model Rasa is serving, or None when Rasa is unreachable"""
+    status = rasa_client.get_status()
+    if not status:
+        return None
+    return status.get('model_id') or status.get('model_file')
+
+reply_cache = ReplyCache(
+    ttl=app.config['REPLY_CACHE_TTL'],
+    max_size=app.config['REPLY_CACHE_SIZE'],
+    model_probe=current_model_id
+)
+
+# Pushes committed messages to the SSE streams of their conversation
+message_broker = MessageBroker(max_pending=app.config['SSE_MAX_PENDING'])
+
+# Per-tenant daily counters behind /analytics, updated in the same transaction as the messages
+rollups = Rollups(
+    Conversation, MessageDaily, IntentDaily,
+    fallback_intents=app.config['FALLBACK_INTENTS'],
+    fallback_confidence=app.config['FALLBACK_CONFIDENCE']
+)
+
+# Persists Message rows off the request path (or inline, in 'sync' durability mode)
+message_writer = MessageWriter(
+    Session, Message, Conversation,
+    durability=app.config['MESSAGE_DURABILITY'],
+    batch_size=app.config['MESSAGE_BATCH_SIZE'],
+    flush_interval=app.config['MESSAGE_FLUSH_INTERVAL'],
+    max_queue=app.config['MESSAGE_QUEUE_SIZE'],
+    on_insert=rollups.record,
+    on_classify=rollups.record_intents,
+    on_commit=message_broker.publish_messages
+)
+atexit.register(message_writer.close)
+
+def on_tenants_changed(rows, changed):
+    """Refresh token versions and drop cached credentials after the tenant registry reloads"""
+    for row in rows:
+        token_revocations.set_version(row.id, tenant_version(row.api_key, row.config))
+    for tenant_id in changed:
+        credential_cache.invalidate_tenant(tenant_id)
+
+# Tenant registry: loads the tenants file, upserts the tenants table and hot-reloads on change
+tenant_manager = TenantManager(
+    app.config['TENANTS_FILE'],
+    session_factory=Session,
+    tenant_model=Tenant,
+    on_change=on_tenants_changed,
+    autoload=False
+)
+
+# Per-tenant request budget (token bucket); the SQLite backend shares buckets between worker processes
+rate_limiter = RateLimiter(
+    create_bucket_store(app.config['RATE_LIMIT_BACKEND']),
+    default_rate=app.config['RATE_LIMIT_PER_SECOND'],
+    default_burst=app.config['RATE_LIMIT_BURST']
+)
+
+# Weighted fair share of the Rasa concurrency so one busy tenant cannot starve the others
+rasa_admission = FairAdmission(app.config['RASA_MAX_CONCURRENCY'], queue_timeout=app.config['RASA_QUEUE_TIMEOUT'])
+
+def check_rate_limit(tenant_id, cost=1):
+    """Charge `cost` requests to the tenant's bucket; limits can be overridden per tenant in its settings"""
+    rate_limiter.check(
+        tenant_id,
+        rate=tenant_manager.get_tenant_setting(tenant_id, 'rate_limit_per_second'),
+        burst=tenant_manager.get_tenant_setting(tenant_id, 'rate_limit_burst'),
+        cost=cost
+    )
+
+def rasa_slot(tenant_id):
+    """Admission slot for one Rasa call of the tenant"""
+    return rasa_admission.slot(
+        tenant_id,
+        weight=float(tenant_manager.get_tenant_setting(tenant_id, 'rasa_weight', app.config['RASA_TENANT_WEIGHT'])),
+        max_concurrent=tenant_manager.get_tenant_setting(tenant_id, 'max_concurrent_rasa')
+    )
+
+def rate_limited(e):
+    return jsonify({'error': 'Rate limit exceeded'}), 429, {'Retry-After': str(e.retry_after)}
+
+# Runs the /model/parse calls beside the webhook calls, so capturing intents adds no latency; parses
+# only start inside an admitted Rasa slot and have their own concurrency limit in the Rasa client
+nlu_executor = ThreadPoolExecutor(max_workers=app.config['RASA_MAX_CONCURRENCY'], thread_name_prefix='nlu')
+
+def parse_intent(message_text):
+    """Intent and confidence of a message as Message fields"""
+    intent = rasa_client.parse(message_text).get('intent') or {}
+    confidence = intent.get('confidence')
+    return {'intent': intent.get('name'), 'confidence': float(confidence) if confidence is not None else None}
+
+def start_intent_capture(message_text):
+    """Start parsing a message in the background; returns None when intent capture is off"""
+    if not app.config['INTENT_CAPTURE_ENABLED']:
+        return None
+    return nlu_executor.submit(parse_intent, message_text)
+
+def captured_intent(future):
+    """Fields from start_intent_capture; empty when the parse failed or is late, so the message is stored without them"""
+    if future is None:
+        return {}
+    try:
+        return future.result(timeout=app.config['INTENT_CAPTURE_TIMEOUT'])
+    except FutureTimeout:
+        logger.warning("Intent capture timed out")
+    except (RasaError, AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"Intent capture failed: {str(e)}")
+    return {}
+
+def get_bot_responses(tenant_id, user_id, message_text):
+    """Rasa replies for one message and the intent fields of the message.
+
+    Replies come from the reply cache for stateless intents when it is enabled;
+    otherwise the message is parsed while Rasa works on the reply.
+    """
+    cache_key = None
+    if app.config['REPLY_CACHE_ENABLED']:
+        normalized = normalize_text(message_text)
+        intent = reply_cache.intent_for(normalized)
+        if intent and intent in tenant_manager.get_tenant_setting(tenant_id, 'stateless_intents', ()):
+            cache_key = normalized
+            with metrics.stage('reply_cache'):
+                cached = reply_cache.get(tenant_id, cache_key)
+            if cached is not None:
+                # An exact training example; there is no parse, so no confidence
+                return [dict(bot_response, recipient_id=user_id) for bot_response in cached], {'intent': intent}
+    
+    # The parse counts against the tenant's fair share, and a rejected request costs nothing
+    with rasa_slot(tenant_id):
+        parsing = start_intent_capture(message_text)
+        with metrics.stage('rasa'):
+            bot_responses = rasa_client.send_message(user_id, message_text, {"tenant_id": tenant_id})
+        with metrics.stage('nlu'):
+            fields = captured_intent(parsing)
+    if cache_key is not None:
+        reply_cache.put(tenant_id, cache_key, bot_responses)
+    return bot_responses, fields
+
+def serialize_job(job, conversation_key):
+    return {
+        'job_id': job.id,
+        'conversation_id': conversation_key,
+        'status': job.status,
+        'responses': json.loads(job.responses) if job.responses else [],
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None
+    }
+
+def process_reply_job(job_id, admission_attempts=3):
+    """Worker side of the async reply mode: call Rasa, store the messages, then notify the tenant"""
+    session = Session()
+    try:
+        # Claim the job, so it runs once even when more than one process has queued it
+        claimed = session.query(ReplyJob).filter_by(id=job_id, status=JOB_PENDING) \
+            .update({'status': JOB_RUNNING, 'started_at': datetime.utcnow()}, synchronize_session=False)
+        session.commit()
+        if not claimed:
+            return
+        row = session.query(ReplyJob, Tenant.tenant_id, Conversation.conversation_id) \
+            .join(Tenant, Tenant.id == ReplyJob.tenant_id) \
+            .join(Conversation, Conversation.id == ReplyJob.conversation_id) \
+            .filter(ReplyJob.id == job_id).first()
+    finally:
+        session.close()
+    if row is None:
+        return
+    job, tenant_id, conversation_key = row
+    
+    responses = None
+    error = None
+    fields = {}
+    for attempt in range(admission_attempts):
+        try:
+            bot_responses, fields = get_bot_responses(tenant_id, job.sender_id, job.message)
+            responses = [bot_response for bot_response in bot_responses if 'text' in bot_response]
+            break
+        except RateLimitExceeded as e:
+            # Fair admission turned us away; this worker can afford to wait for a slot
+            error = 'Rate limit exceeded'
+            time.sleep(e.retry_after)
+        except RasaUnavailable as e:
+            logger.warning(f"Rasa unavailable for job {job_id}: {str(e)}")
+            error = 'Rasa is unavailable, try again later'
+            break
+        except RasaError as e:
+            logger.error(f"Error from Rasa for job {job_id}: {str(e)}")
+            error = 'Failed to get response from Rasa'
+            break
+    
+    # The webhook stored the user message when it queued the job (at job.created_at); add its intent
+    message_writer.classify(job.conversation_id, job.created_at, fields)
+    try:
+        if responses is not None:
+            message_writer.write(
+                job.conversation_id,
+                [{'sender': 'bot', 'content': bot_response['text']} for bot_response in responses]
+            )
+            job.status, job.responses, job.error = JOB_DONE, json.dumps(responses, ensure_ascii=False), None
         else:
-            logger.warning(f"Tenant file {tenant_file} not found")
+            job.status, job.error = JOB_FAILED, error
+    except Exception as e:
+        # Only 'sync' durability raises here; the tenant must not be told the reply was stored
+        logger.error(f"Error saving messages of job {job_id}: {str(e)}")
+        job.status, job.responses, job.error = JOB_FAILED, None, 'Failed to save messages'
+    job.completed_at = datetime.utcnow()
+    
+    session = Session()
+    try:
+        session.query(ReplyJob).filter_by(id=job_id).update({
+            'status': job.status,
+            'responses': job.responses,
+            'error': job.error,
+            'completed_at': job.completed_at
+        })
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    
+    callback_url = tenant_manager.get_tenant_setting(tenant_id, 'callback_url')
+    if callback_url:
+        deliver_callback(
+            callback_url,
+            serialize_job(job, conversation_key),
+            secret=tenant_manager.get_tenant_setting(tenant_id, 'callback_secret'),
+            timeout=app.config['CALLBACK_TIMEOUT'],
+            retries=app.config['CALLBACK_RETRIES']
+        )
+
+# Async reply mode: /webhook answers 202 and these workers talk to Rasa
+reply_jobs = JobQueue(
+    process_reply_job,
+    workers=app.config['ASYNC_REPLY_WORKERS'],
+    max_queue=app.config['ASYNC_REPLY_QUEUE_SIZE']
+)
+# Registered after the message writer so it stops first and its last writes still get flushed
+atexit.register(reply_jobs.close)
+
+_jobs_recovered_pid = None
+
+def recover_reply_jobs():
+    """Queue the jobs left pending by a stopped process and fail the ones it was running.
+
+    Jobs run at most once: a job that may already have reached Rasa is never
+    sent again, so a running job older than ASYNC_REPLY_STALE_AFTER is marked
+    failed and its message is not stored. Pending jobs are claimed before
+    they run, so queueing one that a live process also holds is harmless.
+    """
+    global _jobs_recovered_pid
+    if _jobs_recovered_pid == os.getpid():
+        return
+    _jobs_recovered_pid = os.getpid()
+    
+    now = datetime.utcnow()
+    session = Session()
+    try:
+        lost = session.query(ReplyJob).filter(
+            ReplyJob.status == JOB_RUNNING,
+            ReplyJob.started_at < now - timedelta(seconds=app.config['ASYNC_REPLY_STALE_AFTER'])
+        ).update({'status': JOB_FAILED, 'error': 'Interrupted, send the message again', 'completed_at': now},
+                 synchronize_session=False)
+        session.commit()
+        pending = [job_id for job_id, in
+                   session.query(ReplyJob.id).filter(ReplyJob.status == JOB_PENDING).order_by(ReplyJob.created_at)]
     except Exception as e:
-        logger.error(f"Error loading tenants: {str(e)}")
+        session.rollback()
+        logger.error(f"Error recovering reply jobs: {str(e)}")
+        return
+    finally:
+        session.close()
+    
+    queued = 0
+    for job_id in pending:
+        try:
+            reply_jobs.submit(job_id)
+            queued += 1
+        except queue.Full:
+            break
+    if lost or pending:
+        logger.warning(f"Recovered reply jobs: {queued} of {len(pending)} pending queued again, {lost} interrupted marked failed")
+
+def after_fork():
+    """Drop connections inherited from the parent process; called in each forked server worker"""
+    dispose_engines()
+    # Versions and verified keys inherited from the parent may predate a rotation
+    token_revocations.clear()
+    credential_cache.clear()
+    # The session opens new pools on its next request
+    rasa_client.close()
+
+def start_background_tasks():
+    """Start the threads of a serving process and queue the reply jobs a stopped process left behind.
+
+    Threads do not survive fork, so the server calls this in every worker once
+    its app is loaded, after create_app().
+    """
+    message_writer.start()
+    rasa_client.start_health_checks()
+    recover_reply_jobs()
+    if app.config['TENANTS_RELOAD_INTERVAL'] > 0:
+        tenant_manager.start_watching(app.config['TENANTS_RELOAD_INTERVAL'])
+
+def drain():
+    """Finish queued reply jobs, then flush the message writer"""
+    reply_jobs.close()
+    message_writer.close()
+
+# Load tenant configurations from the tenants file
+def load_tenants():
+    tenant_file = app.config['TENANTS_FILE']
+    if os.path.exists(tenant_file):
+        return tenant_manager.load_tenants()
+    logger.warning(f"Tenant file {tenant_file} not found")
+
+def configure_logging():
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler("logs/api.log"),
+                logging.StreamHandler()
+            ]
+        )
+
+def init_engine():
+    """Create the database engine and bind Session to it; later calls return the same engine"""
+    global engine
+    if engine is None:
+        engine = get_engine(app.config['DATABASE_URI'])
+        Session.configure(bind=engine)
+        metrics.instrument(engine)
+    return engine
+
+def init_db():
+    """Create the engine, missing tables, columns and indexes, and the message search index"""
+    global search_enabled
+    init_engine()
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine, Base.metadata)
+    # Confidence was declared as text before intents were captured
+    convert_column_type(engine, Message.__table__, 'confidence')
+    # create_all skips existing tables, so add indexes introduced after a table was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    # FTS5 index over message content, kept in sync by triggers (SQLite only)
+    search_enabled = search.install(engine)
+
+_initialized = False
+
+def create_app():
+    """Application factory: logging, database, tenant registry and reply cache setup, done once per process.
+
+    Importing this module does no I/O, so scripts that only need the models stay
+    cheap. The server calls this once before forking when it preloads the app,
+    and start_background_tasks() in each worker.
+    """
+    global _initialized
+    if _initialized:
+        return app
+    configure_logging()
+    init_db()
+    if app.config['REPLY_CACHE_ENABLED']:
+        reply_cache.load_phrases(app.config['NLU_FILE'])
+    # Only the tenants table is read here; the file is synced (and its keys hashed) by
+    # provision_tenants.py, or by the preloading server master before it forks
+    if not tenant_manager.tenants:
+        tenant_manager.refresh()
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            signal.signal(signal.SIGHUP, tenant_manager.handle_signal)
+        except ValueError:
+            # Not called from the main thread; rely on mtime polling instead
+            pass
+    _initialized = True
+    return app
 
 # JWT token functions
-def generate_token(tenant_id):
+def generate_token(tenant):
     """Generate JWT token for tenant authentication"""
     payload = {
-        'tenant_id': tenant_id,
+        'tenant_id': tenant.tenant_id,
+        'tid': tenant.id,
+        'ver': tenant.version,
         'exp': datetime.utcnow() + timedelta(days=1)
     }
     token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
@@ -152,11 +696,18 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing!'}), 401
         
-        payload = verify_token(token)
-        if not payload:
+        with metrics.stage('jwt'):
+            payload = verify_token(token)
+        if not payload or 'tid' not in payload:
             return jsonify({'error': 'Invalid token!'}), 401
         
-        return f(payload, *args, **kwargs)
+        # Tokens carry the tenant primary key, so routes never need to look up the tenant
+        if not token_revocations.is_valid(payload['tid'], payload.get('ver')):
+            return jsonify({'error': 'Token has been revoked!'}), 401
+        
+        tenant = TenantContext(payload['tenant_id'], payload['tid'], payload['ver'])
+        g.tenant_id = tenant.tenant_id
+        return f(tenant, *args, **kwargs)
     
     decorated.__name__ = f.__name__
     return decorated
@@ -170,189 +721,458 @@ def api_key_required(f):
         if not api_key or not tenant_id:
             return jsonify({'error': 'API key or tenant ID is missing!'}), 401
         
-        session = Session()
-        tenant = session.query(Tenant).filter_by(tenant_id=tenant_id).first()
-        session.close()
-        
-        if not tenant or not check_password_hash(tenant.api_key, api_key):
-            return jsonify({'error': 'Invalid API key or tenant ID!'}), 401
+        context = credential_cache.get(tenant_id, api_key)
+        if context is None:
+            with metrics.stage('db_lookup'):
+                session = Session()
+                tenant = session.query(Tenant).filter_by(tenant_id=tenant_id).first()
+                session.close()
+            
+            with metrics.stage('password_hash'):
+                verified = tenant is not None and check_password_hash(tenant.api_key, api_key)
+            if not verified:
+                return jsonify({'error': 'Invalid API key or tenant ID!'}), 401
+            
+            context = TenantContext(tenant.tenant_id, tenant.id, tenant_version(tenant.api_key, tenant.config))
+            token_revocations.set_version(context.id, context.version)
+            credential_cache.put(tenant_id, api_key, context)
         
-        return f(tenant_id, *args, **kwargs)
+        g.tenant_id = context.tenant_id
+        return f(context, *args, **kwargs)
     
     decorated.__name__ = f.__name__
     return decorated
 
-# Initialize the app with tenant data
-@app.before_first_request
-def initialize_app():
-    load_tenants()
+def monitoring_allowed():
+    """True when no METRICS_TOKEN is configured or the request carries it as a bearer token"""
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return True
+    auth_header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(auth_header.encode('utf-8'), f"Bearer {token}".encode('utf-8'))
 
 # API Routes
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    rasa_health = False
-    try:
-        rasa_response = requests.get(f"{app.config['RASA_URL']}/status")
-        if rasa_response.status_code == 200:
-            rasa_health = True
-    except:
-        pass
+    """Health check endpoint; the component stats need the metrics token when one is set"""
+    rasa_health = rasa_client.status()
     
-    return jsonify({
+    health = {
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'rasa_status': rasa_health
-    })
+        'rasa_status': rasa_health,
+        'rasa_circuit': rasa_client.circuit_state()
+    }
+    if monitoring_allowed():
+        health.update({
+            'rasa_replicas': rasa_client.pool.stats(),
+            'message_writer': message_writer.stats(),
+            'reply_cache': reply_cache.stats(),
+            'auth_cache': credential_cache.stats(),
+            'rasa_admission': rasa_admission.stats(per_tenant=app.config['METRICS_TENANT_LABELS']),
+            'reply_jobs': reply_jobs.stats(),
+            'streams': message_broker.stats()
+        })
+    return jsonify(health)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of request, stage and query histograms"""
+    if not monitoring_allowed():
+        return jsonify({'error': 'Metrics token is missing or invalid!'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/auth', methods=['POST'])
 @api_key_required
-def authenticate(tenant_id):
+def authenticate(tenant):
     """Authenticate tenant and get JWT token"""
-    token = generate_token(tenant_id)
+    token = generate_token(tenant)
     return jsonify({'token': token})
 
 @app.route('/webhook', methods=['POST'])
 @token_required
-def webhook(payload):
+def webhook(tenant):
     """Webhook endpoint for receiving messages from external platforms"""
-    tenant_id = payload.get('tenant_id')
+    tenant_id = tenant.tenant_id
     data = request.json
     
     if not data or 'user_id' not in data or 'message' not in data:
         return jsonify({'error': 'Invalid payload'}), 400
     
+    try:
+        check_rate_limit(tenant_id)
+    except RateLimitExceeded as e:
+        return rate_limited(e)
+    
     user_id = data['user_id']
     message_text = data['message']
     conversation_id = data.get('conversation_id')
+    # Async mode returns 202 at once and replies through the tenant's callback URL or GET /jobs/<job_id>
+    async_mode = bool(data.get('async', tenant_manager.get_tenant_setting(tenant_id, 'reply_mode') == 'async'))
     
     # Get or create conversation
     session = Session()
+    created = False
     
-    tenant = session.query(Tenant).filter_by(tenant_id=tenant_id).first()
-    if not tenant:
-        session.close()
-        return jsonify({'error': 'Invalid tenant'}), 400
-    
-    user = session.query(User).filter_by(user_id=user_id, tenant_id=tenant.id).first()
-    if not user:
-        user = User(user_id=user_id, tenant_id=tenant.id)
-        session.add(user)
-        session.flush()
-    
-    if not conversation_id:
-        # Create new conversation
-        conversation = Conversation(
-            conversation_id=f"{tenant_id}_{user_id}_{datetime.utcnow().timestamp()}",
-            tenant_id=tenant.id,
-            user_id=user.id
-        )
-        session.add(conversation)
-        session.flush()
-    else:
-        conversation = session.query(Conversation).filter_by(conversation_id=conversation_id).first()
-        if not conversation or conversation.tenant_id != tenant.id:
+    with metrics.stage('db_lookup'):
+        user = session.query(User).filter_by(user_id=user_id, tenant_id=tenant.id).first()
+        if not user:
+            user = User(user_id=user_id, tenant_id=tenant.id)
+            session.add(user)
+            session.flush()
+            created = True
+        
+        if not conversation_id:
+            # Create new conversation
+            conversation = Conversation(
+                conversation_id=f"{tenant_id}_{user_id}_{datetime.utcnow().timestamp()}",
+                tenant_id=tenant.id,
+                user_id=user.id
+            )
+            session.add(conversation)
+            session.flush()
+            created = True
+        else:
+            conversation = session.query(Conversation).filter_by(conversation_id=conversation_id).first()
+            if not conversation or conversation.tenant_id != tenant.id:
+                session.close()
+                return jsonify({'error': 'Invalid conversation ID'}), 400
+    
+    # Only a new user or conversation needs a commit here; messages go through the writer
+    if created:
+        with metrics.stage('commit'):
+            session.commit()
+    
+    # Release the DB connection before the (slow) Rasa round-trip
+    conversation_pk = conversation.id
+    conversation_key = conversation.conversation_id
+    session.close()
+    
+    # Save the user message before calling Rasa, so a slow or failed reply neither loses it nor
+    # hides it from the listings and streams; its intent is added once the parse returns
+    received_at = datetime.utcnow()
+    try:
+        with metrics.stage('persist'):
+            message_writer.write(conversation_pk, [{'sender': 'user', 'content': message_text, 'created_at': received_at}])
+    except Exception as e:
+        logger.error(f"Error saving message: {str(e)}")
+        return jsonify({'error': 'Failed to save message'}), 500
+    
+    if async_mode:
+        job_id = uuid.uuid4().hex
+        session = Session()
+        try:
+            # The job keeps the time of its user message, which the worker classifies
+            session.add(ReplyJob(id=job_id, tenant_id=tenant.id, conversation_id=conversation_pk,
+                                 sender_id=user_id, message=message_text, created_at=received_at))
+            with metrics.stage('commit'):
+                session.commit()
+        finally:
             session.close()
-            return jsonify({'error': 'Invalid conversation ID'}), 400
+        
+        try:
+            reply_jobs.submit(job_id)
+        except queue.Full:
+            session = Session()
+            session.query(ReplyJob).filter_by(id=job_id).update(
+                {'status': JOB_FAILED, 'error': 'Job queue is full', 'completed_at': datetime.utcnow()}
+            )
+            session.commit()
+            session.close()
+            return jsonify({'error': 'Too many pending replies, try again later'}), 503
+        
+        return jsonify({
+            'job_id': job_id,
+            'conversation_id': conversation_key,
+            'status': JOB_PENDING
+        }), 202, {'Location': f"/jobs/{job_id}"}
     
-    # Save user message
-    user_message = Message(
-        conversation_id=conversation.id,
-        sender='user',
-        content=message_text
-    )
-    session.add(user_message)
-    session.commit()
+    # Send message to Rasa (or answer from the reply cache)
+    try:
+        bot_responses, fields = get_bot_responses(tenant_id, user_id, message_text)
+    except (RateLimitExceeded, RasaError) as e:
+        if isinstance(e, RateLimitExceeded):
+            return rate_limited(e)
+        if isinstance(e, RasaUnavailable):
+            logger.warning(f"Rasa unavailable: {str(e)}")
+            return jsonify({'error': 'Rasa is unavailable, try again later'}), 503
+        logger.error(f"Error from Rasa: {str(e)}")
+        return jsonify({'error': 'Failed to get response from Rasa'}), 500
     
-    # Send message to Rasa
     try:
-        rasa_payload = {
-            "sender": user_id,
-            "message": message_text,
-            "metadata": {
-                "tenant_id": tenant_id
-            }
-        }
+        responses = [bot_response for bot_response in bot_responses if 'text' in bot_response]
         
-        rasa_response = requests.post(
-            f"{app.config['RASA_URL']}/webhooks/rest/webhook",
-            json=rasa_payload
-        )
+        with metrics.stage('persist'):
+            message_writer.classify(conversation_pk, received_at, fields)
+            message_writer.write(
+                conversation_pk,
+                [{'sender': 'bot', 'content': bot_response['text']} for bot_response in responses]
+            )
         
-        if rasa_response.status_code == 200:
-            bot_responses = rasa_response.json()
+        return jsonify({
+            'conversation_id': conversation_key,
+            'responses': responses
+        })
+    
+    except Exception as e:
+        # Raised by a 'sync' durability write of the replies that could not be stored
+        logger.error(f"Error processing message: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(tenant, job_id):
+    """Status and bot responses of an async reply; `wait` long-polls for up to that many seconds"""
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['ASYNC_REPLY_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'Invalid wait parameter'}), 400
+    
+    deadline = time.monotonic() + wait
+    # Subscribe before the first read so a job finishing in between still wakes us
+    finished = reply_jobs.subscribe(job_id)
+    try:
+        while True:
+            session = Session()
+            try:
+                with metrics.stage('query'):
+                    row = session.query(ReplyJob, Conversation.conversation_id) \
+                        .join(Conversation, Conversation.id == ReplyJob.conversation_id) \
+                        .filter(ReplyJob.id == job_id, ReplyJob.tenant_id == tenant.id).first()
+            finally:
+                session.close()
             
-            responses = []
-            for bot_response in bot_responses:
-                if 'text' in bot_response:
-                    # Save bot message
-                    bot_message = Message(
-                        conversation_id=conversation.id,
-                        sender='bot',
-                        content=bot_response['text']
-                    )
-                    session.add(bot_message)
-                    responses.append(bot_response)
+            if row is None:
+                return jsonify({'error': 'Job not found'}), 404
             
-            session.commit()
-            session.close()
+            remaining = deadline - time.monotonic()
+            if row[0].status not in (JOB_PENDING, JOB_RUNNING) or remaining <= 0:
+                return jsonify(serialize_job(*row))
             
-            return jsonify({
-                'conversation_id': conversation.conversation_id,
-                'responses': responses
-            })
+            # Re-read at least every second: the job may be running in another worker process
+            finished.wait(min(remaining, 1.0))
+    finally:
+        reply_jobs.unsubscribe(job_id, finished)
+
+@app.route('/webhook/batch', methods=['POST'])
+@token_required
+def webhook_batch(tenant):
+    """Ingest many user messages of one tenant in a single call"""
+    data = request.json
+    items = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Invalid payload'}), 400
+    if len(items) > app.config['BATCH_MAX_SIZE']:
+        return jsonify({'error': f"Batch larger than {app.config['BATCH_MAX_SIZE']} messages"}), 413
+    
+    # Every message of the batch counts against the tenant's rate limit
+    try:
+        check_rate_limit(tenant.tenant_id, cost=len(items))
+    except RateLimitExceeded as e:
+        return rate_limited(e)
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'user_id' not in item or 'message' not in item:
+            results[index] = {'index': index, 'error': 'Invalid payload'}
         else:
+            valid.append(index)
+    
+    # Resolve conversations with a set-based query; new users and conversations are only
+    # created in the final transaction, so a failed batch leaves nothing behind
+    conversation_ids = {items[index]['conversation_id'] for index in valid if items[index].get('conversation_id')}
+    conversations = {}
+    if conversation_ids:
+        session = Session()
+        try:
+            conversations = dict(
+                session.query(Conversation.conversation_id, Conversation.id).filter(
+                    Conversation.tenant_id == tenant.id,
+                    Conversation.conversation_id.in_(conversation_ids)
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error resolving batch: {str(e)}")
+            return jsonify({'error': 'Internal server error'}), 500
+        finally:
             session.close()
-            return jsonify({'error': 'Failed to get response from Rasa'}), 500
     
+    # Messages without a conversation ID start one new conversation per user
+    timestamp = datetime.utcnow().timestamp()
+    targets = {}
+    for index in list(valid):
+        item = items[index]
+        conversation_id = item.get('conversation_id')
+        if conversation_id:
+            if conversation_id not in conversations:
+                results[index] = {'index': index, 'error': 'Invalid conversation ID'}
+                valid.remove(index)
+                continue
+        else:
+            conversation_id = f"{tenant.tenant_id}_{item['user_id']}_{timestamp}"
+        targets[index] = conversation_id
+    
+    # Fan out to Rasa; each sender's messages stay in order so its tracker sees them sequentially
+    by_sender = {}
+    for index in valid:
+        by_sender.setdefault(items[index]['user_id'], []).append(index)
+    
+    replies = {}
+    intents = {}
+    
+    def process_sender(indexes):
+        for index in indexes:
+            item = items[index]
+            try:
+                with rasa_slot(tenant.tenant_id):
+                    parsing = start_intent_capture(item['message'])
+                    replies[index] = rasa_client.send_message(
+                        item['user_id'], item['message'], {"tenant_id": tenant.tenant_id}
+                    )
+                    intents[index] = captured_intent(parsing)
+            except (RasaError, RateLimitExceeded) as e:
+                replies[index] = e
+    
+    if by_sender:
+        workers = min(app.config['BATCH_RASA_PARALLELISM'], len(by_sender))
+        with metrics.stage('rasa'), ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process_sender, by_sender.values()))
+    
+    # Persist the new users and conversations and every message of the batch in one transaction
+    now = datetime.utcnow()
+    rows = []
+    for index in valid:
+        conversation_key = targets[index]
+        rows.append(dict(intents.get(index, {}), conversation_id=conversation_key, sender='user',
+                         content=items[index]['message'], created_at=now))
+        reply = replies.get(index)
+        if isinstance(reply, Exception):
+            if isinstance(reply, RateLimitExceeded):
+                error = 'Rate limit exceeded'
+            elif isinstance(reply, RasaUnavailable):
+                error = 'Rasa is unavailable, try again later'
+            else:
+                error = 'Failed to get response from Rasa'
+            results[index] = {'index': index, 'conversation_id': conversation_key, 'error': error}
+            continue
+        
+        responses = [bot_response for bot_response in reply or [] if 'text' in bot_response]
+        rows.extend(
+            {'conversation_id': conversation_key, 'sender': 'bot', 'content': bot_response['text'], 'created_at': now}
+            for bot_response in responses
+        )
+        results[index] = {'index': index, 'conversation_id': conversation_key, 'responses': responses}
+    
+    session = Session()
+    try:
+        with metrics.stage('commit'):
+            new_conversations = {
+                targets[index]: items[index]['user_id'] for index in valid if targets[index] not in conversations
+            }
+            if new_conversations:
+                user_ids = set(new_conversations.values())
+                users = dict(
+                    session.query(User.user_id, User.id)
+                    .filter(User.tenant_id == tenant.id, User.user_id.in_(user_ids))
+                )
+                new_users = [User(user_id=user_id, tenant_id=tenant.id) for user_id in user_ids if user_id not in users]
+                session.add_all(new_users)
+                session.flush()
+                users.update((user.user_id, user.id) for user in new_users)
+                
+                created = [
+                    Conversation(conversation_id=conversation_key, tenant_id=tenant.id, user_id=users[user_id])
+                    for conversation_key, user_id in new_conversations.items()
+                ]
+                session.add_all(created)
+                session.flush()
+                conversations.update((conversation.conversation_id, conversation.id) for conversation in created)
+            
+            for row in rows:
+                row['conversation_id'] = conversations[row['conversation_id']]
+            inserted = insert_returning(session, Message, rows) if rows else []
+            session.bulk_update_mappings(
+                Conversation,
+                [{'id': conversations[conversation_key], 'updated_at': now, 'status': 'active'}
+                 for conversation_key in set(targets.values())]
+            )
+            rollups.record(session, rows)
+            session.commit()
     except Exception as e:
         session.rollback()
-        session.close()
-        logger.error(f"Error processing message: {str(e)}")
+        logger.error(f"Error saving batch: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        session.close()
+    
+    message_broker.publish_messages(inserted)
+    return jsonify({'results': results})
 
 @app.route('/conversations', methods=['GET'])
 @token_required
-def get_conversations(payload):
-    """Get list of conversations for a tenant"""
-    tenant_id = payload.get('tenant_id')
+def get_conversations(tenant):
+    """Get a page of conversations for a tenant, most recently updated first"""
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        since = parse_timestamp(request.args.get('since'))
+        after = request.args.get('after')
+        cursor = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    status = request.args.get('status')
     
     session = Session()
-    tenant = session.query(Tenant).filter_by(tenant_id=tenant_id).first()
+    # Plain column rows: no ORM identity map or relationship loading for a listing
+    query = session.query(
+        Conversation.id,
+        Conversation.conversation_id,
+        User.user_id,
+        Conversation.status,
+        Conversation.created_at,
+        Conversation.updated_at
+    ).outerjoin(User, User.id == Conversation.user_id).filter(
+        Conversation.tenant_id == tenant.id
+    )
+    if status:
+        query = query.filter(Conversation.status == status)
+    if since:
+        query = query.filter(Conversation.updated_at >= since)
+    if cursor:
+        query = query.filter(keyset_after(Conversation.updated_at, Conversation.id, cursor, descending=True))
+    query = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc())
     
-    if not tenant:
-        session.close()
-        return jsonify({'error': 'Invalid tenant'}), 400
-    
-    conversations = session.query(Conversation).filter_by(tenant_id=tenant.id).all()
-    
-    result = []
-    for conversation in conversations:
-        result.append({
-            'conversation_id': conversation.conversation_id,
-            'user_id': conversation.user.user_id,
-            'status': conversation.status,
-            'created_at': conversation.created_at.isoformat(),
-            'updated_at': conversation.updated_at.isoformat()
-        })
+    with metrics.stage('query'):
+        conversations, next_cursor = paginate(query, limit, 'updated_at')
+    
+    result = [
+        {
+            'conversation_id': row.conversation_id,
+            'user_id': row.user_id,
+            'status': row.status,
+            'created_at': row.created_at,
+            'updated_at': row.updated_at
+        }
+        for row in conversations
+    ]
     
     session.close()
-    return jsonify({'conversations': result})
+    return jsonify({'conversations': result, 'next_cursor': next_cursor})
 
 @app.route('/conversations/<conversation_id>/messages', methods=['GET'])
 @token_required
-def get_conversation_messages(payload, conversation_id):
-    """Get messages for a specific conversation"""
-    tenant_id = payload.get('tenant_id')
+def get_conversation_messages(tenant, conversation_id):
+    """Get a page of messages for a specific conversation, oldest first"""
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        since = parse_timestamp(request.args.get('since'))
+        after = request.args.get('after')
+        cursor = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
     
     session = Session()
-    tenant = session.query(Tenant).filter_by(tenant_id=tenant_id).first()
-    
-    if not tenant:
-        session.close()
-        return jsonify({'error': 'Invalid tenant'}), 400
-    
-    conversation = session.query(Conversation).filter_by(
+    conversation = session.query(Conversation.id).filter_by(
         conversation_id=conversation_id, 
         tenant_id=tenant.id
     ).first()
@@ -361,22 +1181,228 @@ def get_conversation_messages(payload, conversation_id):
         session.close()
         return jsonify({'error': 'Conversation not found'}), 404
     
-    messages = session.query(Message).filter_by(conversation_id=conversation.id).all()
-    
-    result = []
-    for message in messages:
-        result.append({
-            'id': message.id,
-            'sender': message.sender,
-            'content': message.content,
-            'intent': message.intent,
-            'confidence': message.confidence,
-            'created_at': message.created_at.isoformat()
-        })
+    query = session.query(*MESSAGE_COLUMNS).filter(Message.conversation_id == conversation.id)
+    if since:
+        query = query.filter(Message.created_at >= since)
+    if cursor:
+        query = query.filter(keyset_after(Message.created_at, Message.id, cursor))
+    query = query.order_by(Message.created_at, Message.id)
+    
+    with metrics.stage('query'):
+        messages, next_cursor = paginate(query, limit, 'created_at')
+    
+    # Datetimes are left to the JSON provider
+    result = [row._asdict() for row in messages]
     
     session.close()
-    return jsonify({'messages': result})
+    return jsonify({'messages': result, 'next_cursor': next_cursor})
+
+def messages_after(conversation_pk, last_id, batch_size=500):
+    """SSE frames of the committed messages of a conversation with ids above `last_id`, in id order"""
+    while True:
+        session = Session()
+        try:
+            messages = session.query(*MESSAGE_COLUMNS).filter(
+                Message.conversation_id == conversation_pk,
+                Message.id > last_id
+            ).order_by(Message.id).limit(batch_size).all()
+        finally:
+            session.close()
+        for message in messages:
+            yield message.id, format_event(message.id, serialize_message(message))
+        if len(messages) < batch_size:
+            return
+        last_id = messages[-1].id
+
+@app.route('/conversations/<conversation_id>/stream', methods=['GET'])
+@token_required
+def stream_conversation(tenant, conversation_id):
+    """Server-Sent Events stream of new messages in a conversation, resumable through Last-Event-ID"""
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    
+    session = Session()
+    try:
+        conversation = session.query(Conversation.id).filter_by(
+            conversation_id=conversation_id,
+            tenant_id=tenant.id
+        ).first()
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+        conversation_pk = conversation.id
+        # Subscribe before reading the high-water mark so nothing committed in between is lost
+        subscription = message_broker.subscribe(conversation_pk)
+        if last_event_id is None:
+            last_event_id = session.query(func.max(Message.id)).filter(
+                Message.conversation_id == conversation_pk
+            ).scalar() or 0
+    finally:
+        session.close()
+    
+    heartbeat = app.config['SSE_HEARTBEAT']
+    
+    def generate():
+        # Every message up to `caught_up` has been read from the database; `sent` holds the ids
+        # above it that were pushed live, since publishers (threads or other processes) can
+        # commit out of id order and a bare "highest id sent" would skip the stragglers
+        caught_up = last_event_id
+        sent = set()
+        
+        def catch_up():
+            nonlocal caught_up, sent
+            for message_id, frame in messages_after(conversation_pk, caught_up):
+                caught_up = message_id
+                if message_id not in sent:
+                    yield frame
+            sent = {message_id for message_id in sent if message_id > caught_up}
+        
+        yield "retry: 3000\n\n"
+        yield from catch_up()
+        while True:
+            item = subscription.get(heartbeat)
+            if item is not None and not subscription.overflowed:
+                message_id, frame = item
+                if message_id > caught_up and message_id not in sent:
+                    sent.add(message_id)
+                    yield frame
+                continue
+            
+            if item is None:
+                yield ": keepalive\n\n"
+            # Idle or fell behind: catch up from the database, which also picks up
+            # messages committed by other worker processes
+            subscription.overflowed = False
+            yield from catch_up()
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the client left before the first frame
+    response.call_on_close(lambda: message_broker.unsubscribe(subscription))
+    return response
+
+@app.route('/export', methods=['GET'])
+@token_required
+def export_conversations(tenant):
+    """Stream every message of a tenant as NDJSON or CSV, optionally gzipped and including archived messages"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Unsupported export format'}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid export parameters'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    include_archive = request.args.get('archive') in ('1', 'true')
+    
+    # Ordered by message id so `after_id` (the last message_id received) resumes an interrupted export
+    query = (
+        select(
+            Message.id, Conversation.conversation_id, User.user_id, Conversation.status,
+            Message.sender, Message.content, Message.intent, Message.confidence, Message.created_at
+        )
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .outerjoin(User, Conversation.user_id == User.id)
+        .where(Conversation.tenant_id == tenant.id, Message.id > after_id)
+        .order_by(Message.id)
+        .execution_options(yield_per=app.config['EXPORT_BATCH_SIZE'])
+    )
+    if since:
+        query = query.where(Message.created_at >= since)
+    
+    def generate():
+        session = Session()
+        try:
+            rows = session.execute(query)
+            if include_archive:
+                archived = iter_archive(app.config['ARCHIVE_DIR'], tenant.tenant_id, after_id, since)
+                rows = merge_by_id(archived, rows)
+            chunks = iter_ndjson(rows) if export_format == 'ndjson' else iter_csv(rows)
+            if compress:
+                chunks = gzip_stream(chunks)
+            yield from chunks
+        finally:
+            session.close()
+    
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    filename = f"{tenant.tenant_id}.{export_format}"
+    if compress:
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/search', methods=['GET'])
+@token_required
+def search_messages(tenant):
+    """Ranked full-text search over the tenant's messages"""
+    if not search_enabled:
+        return jsonify({'error': 'Search is not available on this database'}), 501
+    
+    query = request.args.get('q', '')
+    match = search.match_expression(tenant.id, query)
+    if match is None:
+        return jsonify({'error': 'q must contain at least one word'}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        after = request.args.get('after')
+        cursor = decode_rank_cursor(after) if after else None
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    
+    with engine.connect() as connection, metrics.stage('query'):
+        rows, last = search.search(
+            connection, tenant.id, match, limit,
+            cursor=cursor, conversation_id=request.args.get('conversation_id')
+        )
+    
+    result = [{
+        'id': row.id,
+        'conversation_id': row.conversation_id,
+        'sender': row.sender,
+        'content': row.content,
+        'snippet': row.snippet,
+        'created_at': row.created_at
+    } for row in rows]
+    return jsonify({'results': result, 'next_cursor': encode_rank_cursor(*last) if last else None})
+
+@app.route('/analytics', methods=['GET'])
+@token_required
+def get_analytics(tenant):
+    """Message volume, fallback rate and intent distribution per day, read from the daily rollups"""
+    try:
+        last_day = parse_timestamp(request.args.get('to'))
+        last_day = last_day.date() if last_day else datetime.utcnow().date()
+        first_day = parse_timestamp(request.args.get('from'))
+        first_day = first_day.date() if first_day else last_day - timedelta(days=app.config['ANALYTICS_DEFAULT_DAYS'] - 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+    if first_day > last_day:
+        return jsonify({'error': 'from must not be after to'}), 400
+    if (last_day - first_day).days >= app.config['ANALYTICS_MAX_DAYS']:
+        return jsonify({'error': f"Date range longer than {app.config['ANALYTICS_MAX_DAYS']} days"}), 400
+    
+    session = Session()
+    try:
+        with metrics.stage('query'):
+            report = rollups.report(session, tenant.id, first_day, last_day)
+    finally:
+        session.close()
+    return jsonify(report)
 
-# Main entry point
+# Development server only; production is served by server.py (gunicorn)
 if __name__ == '__main__':
+    create_app()
+    if app.config['TENANTS_AUTOLOAD']:
+        load_tenants()
+    start_background_tasks()
     app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
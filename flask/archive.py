@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+from datetime import datetime
+
+from export import EXPORT_FIELDS, gzip_stream, iter_ndjson
+
+SEGMENT_SUFFIX = '.ndjson.gz'
+_SEGMENT_NAME = re.compile(r'^(\d+)-(\d+)\.ndjson\.gz$')
+# Every archived record also names its tenant, so a misplaced segment can never leak into another export
+ARCHIVE_FIELDS = EXPORT_FIELDS + ['tenant_id']
+
+
+def tenant_archive_dir(archive_dir, tenant_id):
+    """Directory holding a tenant's segments, named by the SHA-256 of the tenant ID so no two tenants share one"""
+    return os.path.join(archive_dir, hashlib.sha256(tenant_id.encode('utf-8')).hexdigest())
+
+
+def write_segment(archive_dir, tenant_id, rows):
+    """Write rows (EXPORT_FIELDS tuples in message id order) as one gzipped NDJSON segment.
+
+    Segments are named after their first and last message id and are never
+    modified once written; the file only appears after it is complete.
+    """
+    directory = tenant_archive_dir(archive_dir, tenant_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{rows[0][0]:012d}-{rows[-1][0]:012d}{SEGMENT_SUFFIX}")
+    temporary = path + '.tmp'
+    records = (tuple(row) + (tenant_id,) for row in rows)
+    with open(temporary, 'wb') as file:
+        for chunk in gzip_stream(iter_ndjson(records, ARCHIVE_FIELDS)):
+            file.write(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return path
+
+
+def list_segments(archive_dir, tenant_id):
+    """(first_id, last_id, path) of every segment of a tenant, by first id"""
+    directory = tenant_archive_dir(archive_dir, tenant_id)
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_NAME.match(name)
+        if match:
+            segments.append((int(match.group(1)), int(match.group(2)), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+def _read_segment(path, tenant_id, after_id, since):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get('tenant_id') != tenant_id or record['message_id'] <= after_id:
+                continue
+            created_at = datetime.fromisoformat(record['created_at'])
+            if since and created_at < since:
+                continue
+            record['created_at'] = created_at
+            yield tuple(record[field] for field in EXPORT_FIELDS)
+
+
+def merge_by_id(*streams):
+    """Merge row streams that are each sorted by message id, dropping repeated ids"""
+    last_id = None
+    for row in heapq.merge(*streams, key=lambda row: row[0]):
+        if row[0] != last_id:
+            last_id = row[0]
+            yield row
+
+
+def iter_archive(archive_dir, tenant_id, after_id=0, since=None):
+    """Archived rows of a tenant with ids above `after_id`, in message id order"""
+    # Segments whose id ranges do not overlap are read one after another, so only
+    # overlapping runs (normally none) need a file open at the same time
+    chains = []
+    for first_id, last_id, path in list_segments(archive_dir, tenant_id):
+        if last_id <= after_id:
+            continue
+        for chain in chains:
+            if chain[-1][1] < first_id:
+                chain.append((first_id, last_id, path))
+                break
+        else:
+            chains.append([(first_id, last_id, path)])
+
+    streams = [
+        itertools.chain.from_iterable(_read_segment(path, tenant_id, after_id, since) for _, _, path in chain)
+        for chain in chains
+    ]
+    return merge_by_id(*streams)
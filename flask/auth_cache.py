@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# Resolved tenant handed to authenticated routes; `id` is the tenants.id primary key
+TenantContext = namedtuple('TenantContext', ['tenant_id', 'id', 'version'])
+
+
+def tenant_version(api_key_hash, config=None):
+    """Short fingerprint of a tenant's key and config; changes whenever either is rotated"""
+    material = f"{api_key_hash}\x00{config or ''}".encode('utf-8')
+    return hashlib.sha256(material).hexdigest()[:16]
+
+
+class CredentialCache:
+    """In-process cache of verified (tenant_id, api_key) pairs with TTL and LRU eviction"""
+
+    def __init__(self, secret, ttl=300, max_size=1024):
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tenant_keys = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, tenant_id, api_key):
+        """Keyed digest so raw API keys are never held in memory"""
+        message = f"{tenant_id}\x00{api_key}".encode('utf-8')
+        return hmac.new(self.secret, message, hashlib.sha256).digest()
+
+    def get(self, tenant_id, api_key):
+        """Return the cached value for a verified credential, or None"""
+        key = self._digest(tenant_id, api_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, tenant_id, api_key, value):
+        """Remember a credential that has just passed verification"""
+        key = self._digest(tenant_id, api_key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tenant_id, value)
+            self._tenant_keys.setdefault(tenant_id, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def invalidate_tenant(self, tenant_id):
+        """Drop every cached credential of a tenant, e.g. after its key changed"""
+        with self._lock:
+            for key in list(self._tenant_keys.get(tenant_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tenant_keys.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+    def _remove(self, key):
+        _, tenant_id, _ = self._entries.pop(key)
+        keys = self._tenant_keys.get(tenant_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tenant_keys[tenant_id]
+
+
+class TokenRevocations:
+    """Current version per tenant; tokens minted for any other version are rejected.
+
+    Versions are registered by whoever loads tenants or verifies an API key. A
+    tenant this process has not seen yet is looked up with `loader(tenant_pk)`,
+    which returns its current version (None for an unknown tenant), and cached.
+    """
+
+    _REVOKED = object()
+
+    def __init__(self, loader=None):
+        self.loader = loader
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, tenant_pk, version):
+        with self._lock:
+            self._versions[tenant_pk] = version
+
+    def revoke_tenant(self, tenant_pk):
+        """Reject every token of a tenant until a new version is registered"""
+        with self._lock:
+            self._versions[tenant_pk] = self._REVOKED
+
+    def clear(self):
+        """Forget every version, e.g. in a forked worker; they are loaded again on first use"""
+        with self._lock:
+            self._versions.clear()
+
+    def is_valid(self, tenant_pk, version):
+        current = self._versions.get(tenant_pk)
+        if current is None and self.loader is not None:
+            current = self.loader(tenant_pk)
+            if current is None:
+                return False
+            with self._lock:
+                current = self._versions.setdefault(tenant_pk, current)
+        return current is not self._REVOKED and current == version
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Load-test the Flask API against a fake Rasa server.
+
+Boots the app on a temporary SQLite database, seeds synthetic tenants, users
+and conversation histories, drives concurrent requests at /auth, /webhook,
+/conversations and /conversations/<id>/messages, and writes latency
+percentiles, throughput and queries per request as JSON.
+
+    python benchmarks/bench_api.py --scale medium --concurrency 16 --output results.json
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+
+from benchmarks.fake_rasa import start_fake_rasa  # noqa: E402
+
+SCALES = {
+    'small': {'tenants': 3, 'users': 20, 'conversations': 2, 'messages': 10},
+    'medium': {'tenants': 10, 'users': 200, 'conversations': 3, 'messages': 20},
+    'large': {'tenants': 20, 'users': 1000, 'conversations': 5, 'messages': 40},
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=FLASK_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    """Counts SQL statements executed through an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def boot_app(workdir, rasa_url, tenants):
+    """Import the app configured for a temporary database and tenants file"""
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+
+    tenants_file = os.path.join(workdir, 'data', 'tenants.csv')
+    with open(tenants_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['tenant_id', 'name', 'api_key', 'config'])
+        writer.writeheader()
+        for tenant in tenants:
+            writer.writerow(tenant)
+
+    os.environ.update({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'data', 'chatbot.db')}",
+        'RASA_URL': rasa_url,
+        'TENANTS_FILE': tenants_file,
+        'TENANTS_RELOAD_INTERVAL': '0',
+    })
+    os.chdir(workdir)
+
+    import app as api
+    api.create_app()
+    # Servers only read the tenants table; provision the file the way the server master would
+    api.load_tenants()
+    api.start_background_tasks()
+    return api
+
+
+def seed_history(api, scale):
+    """Bulk-insert users, conversations and messages for every tenant"""
+    session = api.Session()
+    now = datetime.utcnow()
+    conversation_keys = {}
+    try:
+        for tenant in session.query(api.Tenant).all():
+            users = [
+                {'user_id': f'user{index}', 'tenant_id': tenant.id, 'created_at': now}
+                for index in range(scale['users'])
+            ]
+            session.bulk_insert_mappings(api.User, users)
+            user_pks = [row.id for row in session.query(api.User.id).filter(api.User.tenant_id == tenant.id)]
+
+            conversations = []
+            for user_pk in user_pks:
+                for index in range(scale['conversations']):
+                    started = now - timedelta(minutes=random.randint(0, 60 * 24 * 30))
+                    conversations.append({
+                        'conversation_id': f'{tenant.tenant_id}_{user_pk}_{index}',
+                        'tenant_id': tenant.id,
+                        'user_id': user_pk,
+                        'status': 'active',
+                        'created_at': started,
+                        'updated_at': started
+                    })
+            session.bulk_insert_mappings(api.Conversation, conversations)
+
+            rows = session.query(api.Conversation.id, api.Conversation.conversation_id, api.Conversation.created_at) \
+                .filter(api.Conversation.tenant_id == tenant.id).all()
+            conversation_keys[tenant.tenant_id] = [row.conversation_id for row in rows]
+
+            messages = []
+            for row in rows:
+                for index in range(scale['messages']):
+                    messages.append({
+                        'conversation_id': row.id,
+                        'sender': 'user' if index % 2 == 0 else 'bot',
+                        'content': 'سلام، سفارش من کی ارسال می‌شود؟' if index % 2 == 0 else 'سفارش شما در حال پردازش است.',
+                        'created_at': row.created_at + timedelta(seconds=index)
+                    })
+                if len(messages) >= 10000:
+                    session.bulk_insert_mappings(api.Message, messages)
+                    messages = []
+            session.bulk_insert_mappings(api.Message, messages)
+            session.commit()
+    finally:
+        session.close()
+    return conversation_keys
+
+
+def run_phase(name, make_request, total, concurrency, counter):
+    """Issue `total` requests with `concurrency` workers and summarise the latencies"""
+    import requests
+
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(index):
+        nonlocal errors
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = make_request(local.session, index)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    queries_before = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(total)))
+    duration = time.perf_counter() - started
+    queries = counter.count - queries_before
+
+    result = {
+        'requests': total,
+        'errors': errors,
+        'duration_s': round(duration, 4),
+        'requests_per_s': round(total / duration, 2) if duration else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries_per_request': round(queries / total, 3)
+    }
+    print(f"{name:<14} {result['requests_per_s']:>9} req/s  p50 {result['p50_ms']:>8} ms  "
+          f"p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+          f"{result['queries_per_request']:>6} q/req  errors {errors}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rasa-latency', type=float, default=0.05, help='fake Rasa delay in seconds')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--output', help='write results JSON to this file')
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    output = os.path.abspath(args.output) if args.output else None
+    random.seed(1)
+
+    rasa_server, rasa_url = start_fake_rasa(args.rasa_latency)
+    # No rate limit, so 429s never mix into the numbers and runs stay comparable across revisions
+    tenants = [
+        {'tenant_id': f'store{index}', 'name': f'فروشگاه {index}', 'api_key': f'bench-key-{index}',
+         'config': json.dumps({'rate_limit_per_second': 0})}
+        for index in range(scale['tenants'])
+    ]
+    workdir = tempfile.mkdtemp(prefix='chatbot-bench-')
+    api = boot_app(workdir, rasa_url, tenants)
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    conversation_keys = seed_history(api, scale)
+    counter = QueryCounter(api.engine)
+
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='api', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    import requests
+
+    tokens = {}
+    for tenant in tenants:
+        response = requests.post(f"{base_url}/auth", headers={
+            'X-API-Key': tenant['api_key'], 'X-Tenant-ID': tenant['tenant_id']
+        })
+        tokens[tenant['tenant_id']] = response.json()['token']
+
+    def pick(index):
+        tenant = tenants[index % len(tenants)]
+        return tenant, {'Authorization': f"Bearer {tokens[tenant['tenant_id']]}"}
+
+    def auth(session, index):
+        tenant = tenants[index % len(tenants)]
+        return session.post(f"{base_url}/auth", headers={
+            'X-API-Key': tenant['api_key'], 'X-Tenant-ID': tenant['tenant_id']
+        })
+
+    def webhook(session, index):
+        tenant, headers = pick(index)
+        keys = conversation_keys[tenant['tenant_id']]
+        return session.post(f"{base_url}/webhook", headers=headers, json={
+            'user_id': f'user{index % scale["users"]}',
+            'message': 'سلام',
+            'conversation_id': random.choice(keys)
+        })
+
+    def conversations(session, index):
+        _, headers = pick(index)
+        return session.get(f"{base_url}/conversations", headers=headers, params={'limit': args.page_size})
+
+    def messages(session, index):
+        tenant, headers = pick(index)
+        conversation_id = random.choice(conversation_keys[tenant['tenant_id']])
+        return session.get(f"{base_url}/conversations/{conversation_id}/messages", headers=headers,
+                           params={'limit': args.page_size})
+
+    print(f"scale={args.scale} concurrency={args.concurrency} rasa_latency={args.rasa_latency}s")
+    results = {}
+    for name, make_request in (('auth', auth), ('webhook', webhook),
+                               ('conversations', conversations), ('messages', messages)):
+        results[name] = run_phase(name, make_request, args.requests, args.concurrency, counter)
+
+    server.shutdown()
+    rasa_server.shutdown()
+    api.message_writer.close()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'config': {
+            'scale': args.scale,
+            'dataset': scale,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rasa_latency_s': args.rasa_latency,
+            'page_size': args.page_size
+        },
+        'results': results
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark of message search: the FTS5 index against a LIKE scan.
+
+Seeds a temporary SQLite database with Persian messages spread over several
+tenants and times one page of results per query both ways. The LIKE scan is
+what a search had to do before the index existed; it also misses spelling
+variants (ي/ی, ك/ک, ZWNJ) that the normalised index matches. The time to
+index the seeded messages from scratch with `search.rebuild` is reported too.
+
+    python benchmarks/bench_search.py --messages 200000 --tenants 20
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+
+from benchmarks.bench_api import boot_app, percentile  # noqa: E402
+from benchmarks.fake_rasa import start_fake_rasa  # noqa: E402
+
+WORDS = [
+    'سلام', 'سفارش', 'ارسال', 'پیگیری', 'کد', 'مرجوعی', 'قیمت', 'تخفیف', 'موجودی', 'رنگ',
+    'سایز', 'پرداخت', 'کارت', 'آدرس', 'تهران', 'اصفهان', 'پست', 'پیک', 'فردا', 'امروز',
+    'لطفا', 'ممنون', 'کی', 'چرا', 'چقدر', 'هنوز', 'نرسیده', 'گارانتی', 'اصل', 'کالا',
+    'می‌شود', 'می‌خواهم', 'نمی‌دانم', 'تحویل', 'هزینه', 'رایگان', 'ساعت', 'کاری', 'تماس', 'شماره'
+]
+# In about one message in 5000; LIKE has to scan the whole tenant to fill a page
+RARE_WORD = 'ضمانت‌نامه'
+QUERIES = ['ارسال', 'کد پیگیری', '"هزینه ارسال"', 'گارانتی اصل', 'تخف*', RARE_WORD]
+
+
+def seed_messages(api, tenants, count, seed):
+    rng = random.Random(seed)
+    session = api.Session()
+    try:
+        tenant_ids = [tenant.id for tenant in session.query(api.Tenant).order_by(api.Tenant.id).all()][:tenants]
+        conversations = []
+        for tenant_id in tenant_ids:
+            for index in range(max(1, count // len(tenant_ids) // 50)):
+                conversation = api.Conversation(conversation_id=f'bench-{tenant_id}-{index}', tenant_id=tenant_id)
+                session.add(conversation)
+                conversations.append(conversation)
+        session.flush()
+        started = datetime.utcnow() - timedelta(days=30)
+        for first in range(0, count, 10000):
+            session.bulk_insert_mappings(api.Message, [
+                {
+                    'conversation_id': rng.choice(conversations).id,
+                    'sender': 'user' if index % 2 == 0 else 'bot',
+                    'content': ' '.join(rng.choices(WORDS, k=rng.randint(3, 14)) + [RARE_WORD] * (rng.random() < 0.0002)),
+                    'created_at': started + timedelta(seconds=index)
+                }
+                for index in range(first, min(first + 10000, count))
+            ])
+        session.commit()
+        return tenant_ids
+    finally:
+        session.close()
+
+
+def like_page(api, tenant_pk, query, page_size):
+    """Search as it could be done before the index: a substring scan of the tenant's messages"""
+    needle = query.strip('"*')
+    session = api.Session()
+    try:
+        rows = session.query(api.Message.id, api.Message.content) \
+            .join(api.Conversation, api.Message.conversation_id == api.Conversation.id) \
+            .filter(api.Conversation.tenant_id == tenant_pk, api.Message.content.like(f"%{needle}%")) \
+            .order_by(api.Message.id.desc()).limit(page_size).all()
+    finally:
+        session.close()
+    return rows
+
+
+def fts_page(api, tenant_pk, query, page_size):
+    with api.engine.connect() as connection:
+        rows, _ = api.search.search(connection, tenant_pk, api.search.match_expression(tenant_pk, query), page_size)
+    return rows
+
+
+def measure(name, run, iterations):
+    timings = []
+    hits = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        hits = len(run())
+        timings.append(time.perf_counter() - start)
+    result = {
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'hits': hits
+    }
+    print(f"  {name:<5} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms  {hits} hits")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results JSON to this file')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    rasa_server, rasa_url = start_fake_rasa(0)
+    tenants = [
+        {'tenant_id': f'store{index}', 'name': f'فروشگاه {index}', 'api_key': f'bench-key-{index}', 'config': '{}'}
+        for index in range(args.tenants)
+    ]
+    api = boot_app(tempfile.mkdtemp(prefix='chatbot-bench-'), rasa_url, tenants)
+
+    start = time.perf_counter()
+    tenant_ids = seed_messages(api, args.tenants, args.messages, args.seed)
+    print(f"seeded {args.messages} messages for {len(tenant_ids)} tenants in {time.perf_counter() - start:.1f}s")
+
+    from retention import Budget
+    start = time.perf_counter()
+    indexed = api.search.rebuild(api.engine, 5000, Budget(), full=True)
+    rebuild_seconds = time.perf_counter() - start
+    print(f"rebuilt index: {indexed} messages in {rebuild_seconds:.1f}s")
+
+    tenant_pk = tenant_ids[len(tenant_ids) // 2]
+    results = {}
+    for query in QUERIES:
+        print(query)
+        results[query] = {
+            'like': measure('like', lambda: like_page(api, tenant_pk, query, args.page_size), args.iterations),
+            'fts': measure('fts', lambda: fts_page(api, tenant_pk, query, args.page_size), args.iterations)
+        }
+    rasa_server.shutdown()
+
+    report = {
+        'config': vars(args),
+        'rebuild_seconds': round(rebuild_seconds, 2),
+        'results': results,
+        'speedup_p50': {
+            query: round(result['like']['p50_ms'] / result['fts']['p50_ms'], 2) for query, result in results.items()
+        }
+    }
+    print('speedup (p50):', ', '.join(f"{query} x{speedup}" for query, speedup in report['speedup_p50'].items()))
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        print(f"Results written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
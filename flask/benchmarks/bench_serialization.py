@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the message listing serialisation path.
+
+Seeds one long conversation in a temporary SQLite database and times building
+a page of messages the old way (full ORM objects, hand-written dicts,
+isoformat() and stdlib json with ASCII escapes) against the current way
+(column rows and the app's JSON provider).
+
+    python benchmarks/bench_serialization.py --messages 20000 --page-size 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FLASK_DIR)
+
+from benchmarks.bench_api import boot_app, percentile  # noqa: E402
+from benchmarks.fake_rasa import start_fake_rasa  # noqa: E402
+
+
+def seed_conversation(api, count):
+    session = api.Session()
+    try:
+        tenant = session.query(api.Tenant).first()
+        user = api.User(user_id='bench-user', tenant_id=tenant.id)
+        session.add(user)
+        session.flush()
+        conversation = api.Conversation(conversation_id='bench-conversation', tenant_id=tenant.id, user_id=user.id)
+        session.add(conversation)
+        session.flush()
+        started = datetime.utcnow() - timedelta(days=1)
+        session.bulk_insert_mappings(api.Message, [
+            {
+                'conversation_id': conversation.id,
+                'sender': 'user' if index % 2 == 0 else 'bot',
+                'content': 'سلام، سفارش من کی ارسال می‌شود؟' if index % 2 == 0 else 'سفارش شما در حال پردازش است.',
+                'created_at': started + timedelta(seconds=index)
+            }
+            for index in range(count)
+        ])
+        session.commit()
+        return conversation.id
+    finally:
+        session.close()
+
+
+def orm_page(api, conversation_pk, page_size):
+    """Listing as it was built before column rows and the fast JSON provider"""
+    session = api.Session()
+    try:
+        messages = session.query(api.Message).filter(api.Message.conversation_id == conversation_pk) \
+            .order_by(api.Message.created_at, api.Message.id).limit(page_size).all()
+        result = [{
+            'id': message.id,
+            'sender': message.sender,
+            'content': message.content,
+            'intent': message.intent,
+            'confidence': message.confidence,
+            'created_at': message.created_at.isoformat()
+        } for message in messages]
+    finally:
+        session.close()
+    return json.dumps({'messages': result, 'next_cursor': None}, sort_keys=True).encode('utf-8')
+
+
+def row_page(api, conversation_pk, page_size):
+    """Listing as the messages endpoint builds it now"""
+    session = api.Session()
+    try:
+        rows = session.query(*api.MESSAGE_COLUMNS).filter(api.Message.conversation_id == conversation_pk) \
+            .order_by(api.Message.created_at, api.Message.id).limit(page_size).all()
+        result = [row._asdict() for row in rows]
+    finally:
+        session.close()
+    return api.app.json.response({'messages': result, 'next_cursor': None}).get_data()
+
+
+def measure(name, build, iterations):
+    timings = []
+    size = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        size = len(build())
+        timings.append(time.perf_counter() - start)
+    result = {
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'bytes': size
+    }
+    print(f"{name:<10} p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  {size} bytes")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000, help='messages in the conversation')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help='write results JSON to this file')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    rasa_server, rasa_url = start_fake_rasa(0)
+    tenants = [{'tenant_id': 'store0', 'name': 'فروشگاه', 'api_key': 'bench-key', 'config': '{}'}]
+    api = boot_app(tempfile.mkdtemp(prefix='chatbot-bench-'), rasa_url, tenants)
+    conversation_pk = seed_conversation(api, args.messages)
+
+    print(f"messages={args.messages} page_size={args.page_size} provider={type(api.app.json).__name__}")
+    with api.app.app_context():
+        results = {
+            'orm_stdlib': measure('orm+json', lambda: orm_page(api, conversation_pk, args.page_size), args.iterations),
+            'rows_provider': measure('rows+fast', lambda: row_page(api, conversation_pk, args.page_size), args.iterations)
+        }
+    speedup = results['orm_stdlib']['p50_ms'] / results['rows_provider']['p50_ms']
+    print(f"speedup x{speedup:.2f}")
+    rasa_server.shutdown()
+
+    report = {
+        'config': vars(args),
+        'provider': type(api.app.json).__name__,
+        'results': results,
+        'speedup_p50': round(speedup, 2)
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
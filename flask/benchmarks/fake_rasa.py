@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeRasaHandler(BaseHTTPRequestHandler):
+    """Answers the Rasa endpoints the API uses after a configurable delay"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    model_id = 'benchmark-model'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send_json({'model_id': self.model_id, 'model_file': f'{self.model_id}.tar.gz'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.path.startswith('/model/parse'):
+            self._send_json({
+                'text': payload.get('text', ''),
+                'intent': {'name': 'greet', 'confidence': 0.95},
+                'entities': []
+            })
+        else:
+            self._send_json([{'recipient_id': payload.get('sender'), 'text': 'سلام! چطور می‌توانم کمکتان کنم؟'}])
+
+
+class FakeRasaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_fake_rasa(latency=0.0, host='127.0.0.1', port=0):
+    """Start a fake Rasa server in a background thread; returns (server, base_url)"""
+    handler = type('Handler', (FakeRasaHandler,), {'latency': latency})
+    server = FakeRasaServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='fake-rasa', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
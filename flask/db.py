@@ -1,15 +1,124 @@
-import sqlite3
 import os
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
 
+from storage import get_engine
+
 # مسیر دیتابیس
 DB_PATH = os.path.join(os.path.dirname(__file__), 'chatbot.db')
 
+# تعداد پیام‌های آخر هر مکالمه که در حافظه نگه داشته می‌شود
+HISTORY_CACHE_SIZE = int(os.environ.get('HISTORY_CACHE_SIZE', 50))
+# سقف کل پیام‌های کش‌شده در همه مکالمات
+HISTORY_CACHE_MAX_MESSAGES = int(os.environ.get('HISTORY_CACHE_MAX_MESSAGES', 100000))
+
+
+class HistoryCache:
+    """کش حلقوی آخرین پیام‌های هر مکالمه با حذف LRU بین مکالمات"""
+
+    def __init__(self, size=HISTORY_CACHE_SIZE, max_messages=HISTORY_CACHE_MAX_MESSAGES):
+        self.size = size
+        self.max_messages = max_messages
+        self.hits = 0
+        self.misses = 0
+        self._conversations = OrderedDict()
+        self._count = 0
+        # مکالمه -> [تعداد خواندن‌های در جریان، شمارنده نوشتن‌ها] برای مکالمه‌هایی که در حال پر شدن از دیتابیس هستند
+        self._fills = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, limit):
+        """آخرین پیام‌ها از کش یا None اگر کش کافی نباشد"""
+        with self._lock:
+            messages = self._conversations.get(key)
+            if messages is None or limit > self.size:
+                self.misses += 1
+                return None
+            self._conversations.move_to_end(key)
+            self.hits += 1
+            return list(messages)[-limit:] if limit > 0 else []
+
+    def put(self, key, messages):
+        """جایگزینی پیام‌های یک مکالمه (قدیمی‌ترین پیام اول)"""
+        with self._lock:
+            self._mark_written(key)
+            self._store(key, messages)
+
+    def begin_fill(self, key):
+        """شروع خواندن مکالمه از دیتابیس؛ نتیجه باید با finish_fill و همین توکن به کش داده شود"""
+        with self._lock:
+            fill = self._fills.setdefault(key, [0, 0])
+            fill[0] += 1
+            return fill[1]
+
+    def finish_fill(self, key, token, messages):
+        """ذخیره نتیجه خواندن (None یعنی چیزی ذخیره نشود)، مگر اینکه پس از begin_fill پیامی برای این مکالمه نوشته شده باشد"""
+        with self._lock:
+            fill = self._fills[key]
+            fill[0] -= 1
+            if fill[0] == 0:
+                del self._fills[key]
+            # نوشتنی که بین SELECT و این لحظه انجام شده در نتیجه خوانده‌شده نیست
+            if messages is None or fill[1] != token:
+                return False
+            self._store(key, messages)
+            return True
+
+    def append(self, key, message):
+        """افزودن پیام جدید؛ فقط اگر مکالمه در کش باشد (write-through)"""
+        with self._lock:
+            self._mark_written(key)
+            messages = self._conversations.get(key)
+            if messages is None:
+                return
+            if len(messages) < self.size:
+                self._count += 1
+            messages.append(message)
+            self._conversations.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._conversations.clear()
+            self._count = 0
+            for fill in self._fills.values():
+                fill[1] += 1
+
+    def _mark_written(self, key):
+        fill = self._fills.get(key)
+        if fill is not None:
+            fill[1] += 1
+
+    def _store(self, key, messages):
+        self._discard(key)
+        self._conversations[key] = deque(messages, maxlen=self.size)
+        self._count += len(self._conversations[key])
+        self._evict()
+
+    def _discard(self, key):
+        messages = self._conversations.pop(key, None)
+        if messages is not None:
+            self._count -= len(messages)
+
+    def _evict(self):
+        while self._count > self.max_messages and self._conversations:
+            _, messages = self._conversations.popitem(last=False)
+            self._count -= len(messages)
+
+
+history_cache = HistoryCache()
+
+def get_connection():
+    """اتصال از pool مشترک لایه storage (با تنظیمات WAL و PRAGMA)؛ close آن را به pool برمی‌گرداند"""
+    return get_engine(f"sqlite:///{DB_PATH}").raw_connection()
+
+
 def init_db():
     """ایجاد دیتابیس و جداول مورد نیاز"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    
+
     # جدول مکالمات
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS conversations (
@@ -20,7 +129,7 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
+
     # جدول پیام‌ها
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS messages (
@@ -32,22 +141,33 @@ def init_db():
         FOREIGN KEY (conversation_id) REFERENCES conversations (id)
     )
     ''')
-    
+
+    # ایندکس‌های پوششی برای جستجوی مکالمه و تاریخچه
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_conversations_session
+    ON conversations (session_id, tenant_id, user_id, id)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_messages_conversation_sent
+    ON messages (conversation_id, sent_at, id)
+    ''')
+
     conn.commit()
     conn.close()
 
 def save_message(session_id, tenant_id, user_id, sender, message):
     """ذخیره پیام در دیتابیس"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    
+    key = (session_id, tenant_id, user_id)
+
     # بررسی وجود مکالمه
     cursor.execute(
-        "SELECT id FROM conversations WHERE session_id = ? AND tenant_id = ? AND user_id = ?", 
+        "SELECT id FROM conversations WHERE session_id = ? AND tenant_id = ? AND user_id = ?",
         (session_id, tenant_id, user_id)
     )
     result = cursor.fetchone()
-    
+
     if result:
         conversation_id = result[0]
     else:
@@ -57,42 +177,67 @@ def save_message(session_id, tenant_id, user_id, sender, message):
             (session_id, tenant_id, user_id)
         )
         conversation_id = cursor.lastrowid
-    
-    # ذخیره پیام
+
+    # ذخیره پیام؛ زمان در پایتون تعیین می‌شود تا کش و دیتابیس یکسان باشند
+    sent_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
     cursor.execute(
-        "INSERT INTO messages (conversation_id, sender, message) VALUES (?, ?, ?)",
-        (conversation_id, sender, message)
+        "INSERT INTO messages (conversation_id, sender, message, sent_at) VALUES (?, ?, ?, ?)",
+        (conversation_id, sender, message, sent_at)
     )
-    
+
     conn.commit()
     conn.close()
-    
+
+    entry = {"sender": sender, "message": message, "timestamp": sent_at}
+    if result:
+        history_cache.append(key, entry)
+    else:
+        # مکالمه تازه است، پس کش آن کامل است
+        history_cache.put(key, [entry])
+
     return True
 
 def get_conversation_history(session_id, tenant_id, user_id, limit=10):
     """دریافت تاریخچه مکالمه"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        """
-        SELECT m.sender, m.message, m.sent_at
-        FROM messages m
-        JOIN conversations c ON m.conversation_id = c.id
-        WHERE c.session_id = ? AND c.tenant_id = ? AND c.user_id = ?
-        ORDER BY m.sent_at DESC
-        LIMIT ?
-        """,
-        (session_id, tenant_id, user_id, limit)
-    )
-    
-    result = cursor.fetchall()
-    conn.close()
-    
-    # برگرداندن نتیجه به صورت لیستی از دیکشنری‌ها
-    history = [
-        {"sender": row[0], "message": row[1], "timestamp": row[2]}
-        for row in result
-    ]
-    
-    return history[::-1]  # معکوس کردن برای نمایش قدیمی‌ترین پیام‌ها اول
\ No newline at end of file
+    key = (session_id, tenant_id, user_id)
+    cached = history_cache.get(key, limit)
+    if cached is not None:
+        return cached
+
+    # پیامی که پس از این نقطه ذخیره شود ممکن است در SELECT دیده نشود، پس نتیجه کش نمی‌شود
+    fill = history_cache.begin_fill(key)
+    complete = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        # در صورت امکان به اندازه کل ظرفیت کش خوانده می‌شود تا درخواست‌های بعدی از حافظه پاسخ داده شوند
+        fetch = max(limit, history_cache.size)
+        cursor.execute(
+            """
+            SELECT m.sender, m.message, m.sent_at
+            FROM messages m
+            JOIN conversations c ON m.conversation_id = c.id
+            WHERE c.session_id = ? AND c.tenant_id = ? AND c.user_id = ?
+            ORDER BY m.sent_at DESC, m.id DESC
+            LIMIT ?
+            """,
+            (session_id, tenant_id, user_id, fetch)
+        )
+
+        result = cursor.fetchall()
+        conn.close()
+
+        # برگرداندن نتیجه به صورت لیستی از دیکشنری‌ها
+        history = [
+            {"sender": row[0], "message": row[1], "timestamp": row[2]}
+            for row in result
+        ]
+        history.reverse()  # معکوس کردن برای نمایش قدیمی‌ترین پیام‌ها اول
+
+        if fetch == history_cache.size:
+            complete = history
+    finally:
+        history_cache.finish_fill(key, fill, complete)
+
+    return history[-limit:] if limit > 0 else []
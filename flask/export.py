@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+EXPORT_FIELDS = [
+    'message_id', 'conversation_id', 'user_id', 'status',
+    'sender', 'content', 'intent', 'confidence', 'created_at'
+]
+
+# Rows are grouped into chunks of roughly this many bytes before being yielded
+CHUNK_SIZE = 64 * 1024
+
+
+def _serialise(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_ndjson(rows, fields=EXPORT_FIELDS):
+    """One JSON object per line; Farsi text is kept as raw UTF-8"""
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps(
+            {field: _serialise(value) for field, value in zip(fields, row)},
+            ensure_ascii=False
+        ) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def iter_csv(rows):
+    """CSV with a header row"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow([_serialise(value) for value in row])
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """Wrap a byte-chunk iterator in a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,55 @@
+import decimal
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib provider below is used instead
+    orjson = None
+
+
+def _default(o):
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Stdlib json with ISO-8601 datetimes and raw UTF-8 (no \\uXXXX escapes for Farsi text)"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+class OrjsonProvider(JSONProvider):
+    """orjson-backed provider; datetimes are encoded natively in the same ISO-8601 form as isoformat()"""
+
+    mimetype = 'application/json'
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=self.option | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def create_json_provider(app):
+    """The fastest JSON provider available for `app`"""
+    if orjson is not None:
+        return OrjsonProvider(app)
+    return StdlibJSONProvider(app)
@@ -0,0 +1,259 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_SYNC = 'sync'
+DURABILITY_GROUP = 'group'
+
+# Queue item kinds: new messages, or the intent of a user message written earlier
+_WRITE = 'write'
+_CLASSIFY = 'classify'
+
+
+def insert_returning(session, model, rows):
+    """Multi-row INSERT that returns the stored rows (with ids and defaults) as dicts"""
+    table = model.__table__
+    # executemany binds every row with the first row's keys, so give all rows the same ones
+    keys = set().union(*rows)
+    params = [{key: row.get(key) for key in keys} for row in rows]
+    return [dict(row._mapping) for row in session.execute(insert(table).returning(*table.c), params)]
+
+
+class MessageWriter:
+    """Persists Message rows and Conversation.updated_at bumps (which also reopen closed conversations).
+
+    In 'sync' mode every write is committed in the caller's thread, and write()
+    raises when the rows could not be stored. In 'group' mode writes are queued
+    and a background thread inserts them in batches, flushed when `batch_size`
+    rows are pending or `flush_interval` seconds passed; rows it cannot store are
+    logged and counted as failed.
+    `on_insert`, if given, is called with the session and the rows before the
+    commit, to update derived tables in the same transaction; `on_classify`
+    likewise with the user messages that classify() gave an intent. `on_commit`,
+    if given, is called with the committed rows (including their ids).
+    """
+
+    def __init__(self, session_factory, message_model, conversation_model, durability=DURABILITY_GROUP,
+                 batch_size=200, flush_interval=0.05, max_queue=10000, enqueue_timeout=1.0, on_insert=None,
+                 on_classify=None, on_commit=None):
+        if durability not in (DURABILITY_SYNC, DURABILITY_GROUP):
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.Session = session_factory
+        self.Message = message_model
+        self.Conversation = conversation_model
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.on_insert = on_insert
+        self.on_classify = on_classify
+        self.on_commit = on_commit
+
+        self.written = 0
+        self.classified = 0
+        self.batches = 0
+        self.failed = 0
+        self.sync_fallbacks = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, conversation_id, messages):
+        """Persist messages (dicts with sender/content and optional intent/confidence) for one conversation"""
+        now = datetime.utcnow()
+        rows = []
+        for message in messages:
+            row = {'conversation_id': conversation_id, 'created_at': message.get('created_at', now)}
+            row.update(message)
+            rows.append(row)
+        if not rows:
+            return
+
+        item = (_WRITE, conversation_id, rows, now)
+        if self.durability == DURABILITY_SYNC:
+            # The caller was promised a durable write, so a failure must reach it
+            self._flush([item], raise_errors=True)
+            return
+        self._enqueue(item)
+
+    def classify(self, conversation_id, created_at, fields):
+        """Set the intent fields of the user message written for `conversation_id` at `created_at`.
+
+        Queued behind that write, so it applies once the message is stored. The
+        intent is best effort: a failure is logged, never raised.
+        """
+        if not fields:
+            return
+        item = (_CLASSIFY, conversation_id, fields, created_at)
+        if self.durability == DURABILITY_SYNC:
+            self._flush([item])
+            return
+        self._enqueue(item)
+
+    def _enqueue(self, item):
+        self._ensure_started()
+        try:
+            # Bounded wait gives callers back-pressure when the writer falls behind
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.sync_fallbacks += 1
+            self._flush([item])
+
+    def start(self):
+        """Start the background writer now rather than on the first write ('group' mode only)"""
+        if self.durability == DURABILITY_GROUP:
+            self._ensure_started()
+
+    def _ensure_started(self):
+        # Started lazily, and again after fork, since threads do not survive fork()
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+
+            batch = [item]
+            pending = len(item[2]) if item[0] == _WRITE else 1
+            deadline = time.monotonic() + self.flush_interval
+            while pending < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                pending += len(item[2]) if item[0] == _WRITE else 1
+
+            self._flush(batch)
+
+        # Drain whatever is still queued
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                batch.append(item)
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch, attempts=3, raise_errors=False):
+        rows = []
+        bumps = {}
+        intents = []
+        for kind, conversation_id, payload, timestamp in batch:
+            if kind == _CLASSIFY:
+                intents.append(dict(payload, conversation_id=conversation_id, sender='user', created_at=timestamp))
+                continue
+            rows.extend(payload)
+            bumps[conversation_id] = max(timestamp, bumps.get(conversation_id, timestamp))
+
+        for attempt in range(attempts):
+            session = self.Session()
+            inserted = None
+            try:
+                if rows:
+                    if self.on_commit:
+                        inserted = insert_returning(session, self.Message, rows)
+                    else:
+                        session.bulk_insert_mappings(self.Message, rows)
+                    # A new message reopens a conversation closed by the retention job
+                    session.bulk_update_mappings(
+                        self.Conversation,
+                        [{'id': conversation_id, 'updated_at': timestamp, 'status': 'active'}
+                         for conversation_id, timestamp in bumps.items()]
+                    )
+                    if self.on_insert:
+                        self.on_insert(session, rows)
+                # After the inserts, since a message and its intent can be in the same batch
+                classified = self._classify(session, intents)
+                if classified and self.on_classify:
+                    self.on_classify(session, classified)
+                session.commit()
+                self.written += len(rows)
+                self.classified += len(classified)
+                self.batches += 1
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error writing {len(rows)} messages (attempt {attempt + 1}): {str(e)}")
+                error = e
+                if attempt + 1 < attempts:
+                    time.sleep(0.1 * (attempt + 1))
+                continue
+            finally:
+                session.close()
+
+            if inserted:
+                try:
+                    self.on_commit(inserted)
+                except Exception as e:
+                    logger.error(f"Error in message commit hook: {str(e)}")
+            return
+
+        self.failed += len(rows)
+        if raise_errors:
+            raise error
+
+    def _classify(self, session, intents):
+        """Store the intent fields on their user messages; returns the ones that matched a message"""
+        Message = self.Message
+        classified = []
+        for fields in intents:
+            values = {key: value for key, value in fields.items() if key in ('intent', 'confidence')}
+            # Only an unclassified message, so a replayed classification is not counted twice
+            updated = session.query(Message).filter(
+                Message.conversation_id == fields['conversation_id'],
+                Message.sender == 'user',
+                Message.created_at == fields['created_at'],
+                Message.intent.is_(None)
+            ).update(values, synchronize_session=False)
+            if updated:
+                classified.append(fields)
+        return classified
+
+    def close(self, timeout=10):
+        """Stop the background writer after flushing everything queued"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            'durability': self.durability,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'classified': self.classified,
+            'batches': self.batches,
+            'failed': self.failed,
+            'sync_fallbacks': self.sync_fallbacks
+        }
@@ -0,0 +1,179 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        bucket_labels = self.labels + ('le',)
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_format_labels(bucket_labels, label_values + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels, label_values + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, label_values)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, label_values)} {count}')
+        return lines
+
+
+class Metrics:
+    """Per-request stage timers, SQL query counting and Prometheus text exposition.
+
+    Series are labelled with the tenant only when `tenant_labels` is set;
+    otherwise they are aggregated over all tenants.
+    """
+
+    def __init__(self, slow_request_threshold=1.0, slow_request_sample_rate=0.1, tenant_labels=False):
+        self.slow_request_threshold = slow_request_threshold
+        self.slow_request_sample_rate = slow_request_sample_rate
+        self.tenant_labels = tenant_labels
+        tenant = ('tenant',) if tenant_labels else ()
+        self.requests = Histogram(
+            'chatbot_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method', 'status') + tenant
+        )
+        self.stages = Histogram(
+            'chatbot_stage_duration_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage') + tenant
+        )
+        self.queries = Histogram(
+            'chatbot_request_queries', 'SQL statements executed per request', ('endpoint',) + tenant, QUERY_BUCKETS
+        )
+        self.collectors = [self.requests, self.stages, self.queries]
+        # Request state lives in a thread-local so engine events (which have no app context) can reach it
+        self._local = threading.local()
+
+    def counter(self, name, help_text, labels=()):
+        collector = Counter(name, help_text, labels)
+        self.collectors.append(collector)
+        return collector
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        collector = Histogram(name, help_text, labels, buckets)
+        self.collectors.append(collector)
+        return collector
+
+    def init_app(self, app, engine=None):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if engine is not None:
+            self.instrument(engine)
+
+    def instrument(self, engine):
+        """Count the SQL statements `engine` runs during each request"""
+        event.listen(engine, 'before_cursor_execute', self._count_query)
+
+    def _before_request(self):
+        self._local.state = {'queries': 0, 'stages': {}}
+        g.metrics_start = time.perf_counter()
+
+    def _count_query(self, *args):
+        state = getattr(self._local, 'state', None)
+        if state is not None:
+            state['queries'] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of the current request under `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            state = getattr(self._local, 'state', None)
+            if state is not None:
+                state['stages'][name] = state['stages'].get(name, 0.0) + elapsed
+
+    def _after_request(self, response):
+        state = getattr(self._local, 'state', None)
+        start = g.get('metrics_start')
+        if state is None or start is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        tenant = g.get('tenant_id') or '-'
+        labels = (tenant,) if self.tenant_labels else ()
+        self.requests.observe((endpoint, request.method, str(response.status_code)) + labels, elapsed)
+        self.queries.observe((endpoint,) + labels, state['queries'])
+        for stage, duration in state['stages'].items():
+            self.stages.observe((endpoint, stage) + labels, duration)
+
+        if elapsed >= self.slow_request_threshold and random.random() < self.slow_request_sample_rate:
+            breakdown = ', '.join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in state['stages'].items())
+            logger.warning(
+                f"Slow request {request.method} {request.path} tenant={tenant} status={response.status_code} "
+                f"total={elapsed * 1000:.1f}ms queries={state['queries']} stages: {breakdown or 'none'}"
+            )
+        return response
+
+    def _teardown_request(self, exc=None):
+        self._local.state = None
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return '\n'.join(lines) + '\n'
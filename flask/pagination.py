@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor pointing at the last row of a page"""
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def encode_rank_cursor(rank, row_id):
+    """Opaque cursor for results ordered by (rank, id), such as search hits"""
+    raw = json.dumps([rank, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_rank_cursor(cursor):
+    """Inverse of encode_rank_cursor; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return float(rank), int(row_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value, default, maximum):
+    """Page size from a query parameter, clamped to [1, maximum]"""
+    if value is None:
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def parse_timestamp(value):
+    """ISO-8601 timestamp from a query parameter as naive UTC (how timestamps are stored), or None"""
+    if not value:
+        return None
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def keyset_after(timestamp_column, id_column, cursor, descending=False):
+    """Filter selecting rows strictly after `cursor` in (timestamp, id) order"""
+    timestamp, row_id = cursor
+    if descending:
+        return or_(timestamp_column < timestamp, and_(timestamp_column == timestamp, id_column < row_id))
+    return or_(timestamp_column > timestamp, and_(timestamp_column == timestamp, id_column > row_id))
+
+
+def paginate(query, limit, timestamp_attr):
+    """Fetch one row more than `limit` to learn whether another page exists.
+
+    Returns (rows, next_cursor) where next_cursor is None on the last page.
+    """
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, timestamp_attr), last.id)
@@ -0,0 +1,39 @@
+import re
+
+ZWNJ = '‌'
+
+# Arabic code points that have a Persian counterpart
+_CHAR_MAP = str.maketrans({
+    'ي': 'ی',  # Arabic yeh -> Persian yeh
+    'ى': 'ی',  # alef maksura -> Persian yeh
+    'ك': 'ک',  # Arabic kaf -> Persian keheh
+    'ة': 'ه',  # teh marbuta -> heh
+    'ۀ': 'ه',  # heh with yeh above -> heh
+    'أ': 'ا',  # alef with hamza above -> alef
+    'إ': 'ا',  # alef with hamza below -> alef
+    'ؤ': 'و',  # waw with hamza -> waw
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Persian digits
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+})
+
+# Harakat, superscript alef and tatweel
+_DIACRITICS = re.compile('[ً-ٰٟـ]')
+# Latin and Persian punctuation is dropped for matching
+_PUNCTUATION = re.compile('[.,!?;:()\\[\\]"\'؟،؛۔«»]')
+# Whitespace, ZWNJ/ZWJ and direction marks all collapse to a single space
+_SEPARATORS = re.compile('[\\s‌‍‎‏]+')
+
+
+def normalize_text(text):
+    """Canonical form of Persian text for matching: unified letters, no diacritics or punctuation, ZWNJ as space"""
+    text = text.translate(_CHAR_MAP)
+    text = _DIACRITICS.sub('', text)
+    text = _PUNCTUATION.sub(' ', text)
+    text = _SEPARATORS.sub(' ', text)
+    return text.strip().lower()
+
+
+def tokenize(text):
+    """Normalised word tokens"""
+    normalized = normalize_text(text)
+    return normalized.split(' ') if normalized else []
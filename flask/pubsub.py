@@ -0,0 +1,108 @@
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event_id, data, event='message'):
+    """One Server-Sent Events frame"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def serialize_message(row):
+    """Wire form of a message row (dict or row object), as in the messages endpoint"""
+    get = row.get if isinstance(row, dict) else lambda key: getattr(row, key)
+    created_at = get('created_at')
+    return {
+        'id': get('id'),
+        'sender': get('sender'),
+        'content': get('content'),
+        'intent': get('intent'),
+        'confidence': get('confidence'),
+        'created_at': created_at.isoformat() if created_at else None
+    }
+
+
+class Subscription:
+    """Queue of (message_id, frame) pairs for one stream; `overflowed` is set when it fell too far behind"""
+
+    def __init__(self, key, max_pending):
+        self.key = key
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def push(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout):
+        """Next (message_id, frame) or None when nothing arrived within `timeout`"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MessageBroker:
+    """In-process fan-out of committed messages to the streams subscribed to their conversation.
+
+    Each message is serialised once, however many subscribers receive it. A
+    subscriber that stops reading is marked overflowed instead of blocking
+    publishers; the stream then resumes from the database.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self.published = 0
+        self.dropped = 0
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key):
+        subscription = Subscription(key, self.max_pending)
+        with self._lock:
+            self._subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.key]
+
+    def publish_messages(self, rows):
+        """Fan out committed message rows (dicts with id and conversation_id)"""
+        with self._lock:
+            targets = {
+                row['conversation_id']: list(self._subscriptions[row['conversation_id']])
+                for row in rows if row['conversation_id'] in self._subscriptions
+            }
+        if not targets:
+            return
+
+        for row in rows:
+            subscriptions = targets.get(row['conversation_id'])
+            if not subscriptions or row.get('id') is None:
+                continue
+            item = (row['id'], format_event(row['id'], serialize_message(row)))
+            for subscription in subscriptions:
+                if not subscription.push(item):
+                    self.dropped += 1
+            self.published += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+                'conversations': len(self._subscriptions),
+                'published': self.published,
+                'dropped': self.dropped
+            }
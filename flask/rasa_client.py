@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from rasa_pool import STATE_READY, ReplicaPool
+
+
+class RasaError(Exception):
+    """Rasa returned an error or could not be reached"""
+
+
+class RasaUnavailable(RasaError):
+    """Call rejected without contacting Rasa (circuit open or concurrency limit reached)"""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one probe through after `reset_timeout` seconds"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # Let a single probe request decide whether Rasa is back
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt, base=0.1, cap=2.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def connect_failed(error):
+    """True when a requests error happened while connecting, so Rasa never received the request"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose `reason` is the underlying failure
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+
+class RasaClient:
+    """Thread-safe client for the Rasa REST channel with pooled keep-alive connections.
+
+    `base_url` may list several Rasa replicas separated by commas; the
+    ReplicaPool health-checks them, warms them up with `warmup_messages` (a
+    list, or a callable returning one) and spreads the calls between them.
+    At most `max_concurrency` webhook calls and `max_parse_concurrency`
+    /model/parse calls (as many by default) are in flight; the two limits are
+    separate so parsing never crowds out replies.
+    """
+
+    def __init__(self, base_url, connect_timeout=2.0, read_timeout=30.0, max_concurrency=32,
+                 retries=2, failure_threshold=5, reset_timeout=30, health_interval=5.0, load_factor=1.25,
+                 warmup_messages=(), max_parse_concurrency=None):
+        urls = base_url.split(',') if isinstance(base_url, str) else base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.warmup_messages = warmup_messages
+        self.pool = ReplicaPool(
+            [url.strip().rstrip('/') for url in urls if url.strip()],
+            breaker_factory=lambda: CircuitBreaker(failure_threshold, reset_timeout),
+            probe=self._probe,
+            warm_up=self._warm_up,
+            health_interval=health_interval,
+            load_factor=load_factor
+        )
+        max_parse_concurrency = max_parse_concurrency or max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._parse_slots = threading.BoundedSemaphore(max_parse_concurrency)
+        self._slot_timeout = connect_timeout
+
+        self.session = requests.Session()
+        # One keep-alive pool per replica
+        adapter = HTTPAdapter(pool_connections=len(self.pool.replicas),
+                              pool_maxsize=max_concurrency + max_parse_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send_message(self, sender, message, metadata=None):
+        """Send a user message to the REST webhook and return the list of bot responses"""
+        payload = {'sender': sender, 'message': message, 'metadata': metadata or {}}
+        # Sticky per sender, so the conversation's tracker stays with one replica
+        response = self._post('/webhooks/rest/webhook', payload, sender=sender)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise RasaError('Rasa returned an invalid JSON body') from e
+
+    def parse(self, message):
+        """Run the NLU pipeline on a message (POST /model/parse, needs --enable-api); returns the parse result"""
+        response = self._post('/model/parse', {'text': message}, slots=self._parse_slots)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise RasaError('Rasa returned an invalid JSON body') from e
+
+    def status(self, timeout=2.0):
+        """Probe /status without going through the breakers; returns True when a Rasa replica is up"""
+        return self.get_status(timeout) is not None
+
+    def get_status(self, timeout=2.0):
+        """Body of /status (includes the loaded model file) of the first replica that answers, or None"""
+        for replica in sorted(self.pool.replicas, key=lambda replica: replica.state != STATE_READY):
+            status = self._probe(replica.url, timeout)
+            if status is not None:
+                return status
+        return None
+
+    def _probe(self, url, timeout=2.0):
+        try:
+            response = self.session.get(f"{url}/status", timeout=timeout)
+            if response.status_code == 200:
+                return response.json()
+        except (requests.RequestException, ValueError):
+            pass
+        return None
+
+    def _warm_up(self, url):
+        """Parse the warm-up messages on one replica, so its first real requests do not pay for loading"""
+        messages = self.warmup_messages() if callable(self.warmup_messages) else self.warmup_messages
+        for message in messages:
+            response = self.session.post(f"{url}/model/parse", json={'text': message}, timeout=self.timeout)
+            if response.status_code != 200:
+                raise RasaError(f"Rasa returned HTTP {response.status_code}")
+
+    def start_health_checks(self):
+        """Start probing and warming up the replicas in this process"""
+        self.pool.start()
+
+    def _post(self, path, payload, sender=None, slots=None):
+        slots = slots or self._slots
+        if not slots.acquire(timeout=self._slot_timeout):
+            raise RasaUnavailable('Too many concurrent Rasa requests')
+
+        try:
+            excluded = set()
+            attempt = 0
+            error = None
+            while True:
+                replica = self.pool.acquire(sender, excluded)
+                if replica is None:
+                    if error is not None:
+                        raise RasaError(str(error)) from error
+                    raise RasaUnavailable('Rasa circuit breaker is open')
+                if not replica.breaker.allow():
+                    self.pool.release(replica, sender)
+                    excluded.add(replica)
+                    continue
+                try:
+                    response = self.session.post(f"{replica.url}{path}", json=payload, timeout=self.timeout)
+                except requests.ConnectionError as e:
+                    # Only a failed connect is safe to send again, to another replica if there is one; a
+                    # connection dropped after the request was sent may already have reached the tracker
+                    if attempt < self.retries and connect_failed(e):
+                        if len(self.pool.replicas) > 1:
+                            self.pool.record_failure(replica)
+                            excluded.add(replica)
+                            error = e
+                        else:
+                            time.sleep(backoff_delay(attempt))
+                        attempt += 1
+                        continue
+                    self.pool.record_failure(replica)
+                    raise RasaError(str(e)) from e
+                except requests.RequestException as e:
+                    self.pool.record_failure(replica)
+                    raise RasaError(str(e)) from e
+                finally:
+                    self.pool.release(replica, sender)
+
+                if response.status_code >= 500:
+                    self.pool.record_failure(replica)
+                    raise RasaError(f"Rasa returned HTTP {response.status_code}")
+                self.pool.record_success(replica)
+                if response.status_code != 200:
+                    raise RasaError(f"Rasa returned HTTP {response.status_code}")
+                return response
+        finally:
+            slots.release()
+
+    def circuit_state(self):
+        return self.pool.circuit_state()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_UNKNOWN = 'unknown'  # not probed yet
+STATE_DOWN = 'down'
+STATE_WARMING = 'warming'
+STATE_READY = 'ready'
+
+
+def _rendezvous_score(sender, url):
+    # Stable across processes, unlike hash(), so every worker sends a sender to the same replica
+    return hashlib.blake2b(f"{url}|{sender}".encode('utf-8'), digest_size=8).digest()
+
+
+class Replica:
+    """One Rasa endpoint with its own circuit breaker and load counters"""
+
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        self.state = STATE_UNKNOWN
+        self.model_id = None
+        self.outstanding = 0
+        self.served = 0
+        self.last_used = 0.0
+
+
+class ReplicaPool:
+    """Picks the Rasa replica for each call.
+
+    Calls for a sender go to the replica the sender hashes to (rendezvous
+    hashing), so its tracker and lock stay with one Rasa process. They move to
+    the replica with the fewest outstanding requests only when that replica is
+    down or has more than `load_factor` times the average load; 0 disables
+    that. Calls without a sender always go to the least busy replica.
+
+    Every `health_interval` seconds a thread per replica probes it with
+    `probe(url)` (the /status body, or None when down). A replica that comes
+    up, or starts serving another model, gets `warm_up(url)` before it is
+    ready. Replicas that are warming up only get calls when none is ready.
+    """
+
+    def __init__(self, urls, breaker_factory, probe, warm_up, health_interval=5.0, load_factor=1.25):
+        if not urls:
+            raise ValueError("At least one Rasa URL is required")
+        self.replicas = [Replica(url, breaker_factory()) for url in urls]
+        self.probe = probe
+        self.warm_up = warm_up
+        self.health_interval = health_interval
+        self.load_factor = load_factor
+
+        self._lock = threading.Lock()
+        self._senders = {}
+        self._threads = []
+        self._pid = None
+        self._stop = threading.Event()
+
+    def acquire(self, sender=None, exclude=()):
+        """Choose a replica and count a call against it, or None when every replica is excluded"""
+        self.start()
+        with self._lock:
+            available = [replica for replica in self.replicas if replica not in exclude]
+            candidates = (
+                [replica for replica in available if replica.state == STATE_READY]
+                or [replica for replica in available if replica.state == STATE_WARMING]
+                # Nothing known to be up; the circuit breakers decide
+                or available
+            )
+            if not candidates:
+                return None
+            replica = self._choose(candidates, sender)
+            replica.outstanding += 1
+            replica.served += 1
+            replica.last_used = time.monotonic()
+            if sender is not None:
+                entry = self._senders.get(sender)
+                if entry is None:
+                    self._senders[sender] = [replica, 1]
+                else:
+                    entry[0] = replica
+                    entry[1] += 1
+            return replica
+
+    def release(self, replica, sender=None):
+        with self._lock:
+            replica.outstanding -= 1
+            entry = self._senders.get(sender) if sender is not None else None
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._senders[sender]
+
+    def _choose(self, candidates, sender):
+        # Least outstanding requests; the least recently used wins ties, so idle replicas take turns
+        least_busy = min(candidates, key=lambda replica: (replica.outstanding, replica.last_used))
+        if sender is None or len(candidates) == 1:
+            return least_busy
+        # A sender with a call in flight stays where it is, so Rasa never handles two of its messages at once
+        entry = self._senders.get(sender)
+        if entry is not None and entry[0] in candidates:
+            return entry[0]
+        preferred = max(candidates, key=lambda replica: _rendezvous_score(sender, replica.url))
+        if self.load_factor <= 0:
+            return preferred
+        total = sum(replica.outstanding for replica in candidates)
+        if preferred.outstanding < math.ceil(self.load_factor * (total + 1) / len(candidates)):
+            return preferred
+        return least_busy
+
+    def record_success(self, replica):
+        replica.breaker.record_success()
+
+    def record_failure(self, replica):
+        replica.breaker.record_failure()
+        if replica.breaker.state == replica.breaker.OPEN and replica.state != STATE_DOWN:
+            replica.state = STATE_DOWN
+            logger.warning(f"Rasa replica {replica.url} is failing, taking it out of rotation")
+
+    def start(self):
+        """Start the health checks in this process (again after fork, since threads do not survive it)"""
+        if self.health_interval <= 0 or (self._threads and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._watch, args=(replica,), name=f'rasa-health-{index}', daemon=True)
+                for index, replica in enumerate(self.replicas)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self, replica):
+        stop = self._stop
+        while not stop.is_set():
+            try:
+                self.check(replica)
+            except Exception as e:
+                logger.error(f"Error checking Rasa replica {replica.url}: {str(e)}")
+            stop.wait(self.health_interval)
+
+    def check(self, replica):
+        """Probe one replica and warm it up if it has just come up or loaded another model"""
+        status = self.probe(replica.url)
+        if status is None:
+            if replica.state != STATE_DOWN:
+                logger.warning(f"Rasa replica {replica.url} is down")
+            replica.state = STATE_DOWN
+            return
+        model_id = status.get('model_id') or status.get('model_file')
+        if replica.state == STATE_READY and model_id == replica.model_id:
+            return
+
+        replica.state = STATE_WARMING
+        replica.model_id = model_id
+        start = time.monotonic()
+        try:
+            self.warm_up(replica.url)
+        except Exception as e:
+            logger.warning(f"Warm-up of Rasa replica {replica.url} failed: {str(e)}")
+            replica.state = STATE_DOWN
+            return
+        replica.breaker.record_success()
+        replica.state = STATE_READY
+        logger.info(f"Rasa replica {replica.url} is ready (model {model_id}, warmed up in {time.monotonic() - start:.1f}s)")
+
+    def circuit_state(self):
+        """Best breaker state across the replicas: closed while any replica accepts calls"""
+        states = {replica.breaker.state for replica in self.replicas}
+        for state in ('closed', 'half_open'):
+            if state in states:
+                return state
+        return 'open'
+
+    def stats(self):
+        return [{
+            'url': replica.url,
+            'state': replica.state,
+            'model_id': replica.model_id,
+            'outstanding': replica.outstanding,
+            'served': replica.served,
+            'circuit': replica.breaker.state
+        } for replica in self.replicas]
@@ -0,0 +1,188 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class RateLimitExceeded(Exception):
+    """Request rejected; `retry_after` is the number of seconds the client should wait"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + (now - updated_at) * rate)
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Remove `cost` tokens; returns 0 on success or the seconds until enough tokens exist"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated_at, now, rate, burst)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+        return (cost - tokens) / rate if rate > 0 else 60
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file, shared by every process on the host"""
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Opened on first use, and never shared with a forked child
+        conn, pid = getattr(self._local, 'conn', (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.conn = (conn, os.getpid())
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        # Wall-clock time, since monotonic clocks are not comparable across processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, rate, burst) if row else burst
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if allowed:
+            return 0
+        return (cost - tokens) / rate if rate > 0 else 60
+
+
+def create_bucket_store(backend):
+    """'memory' or 'sqlite:///path/to/file.db'"""
+    if not backend or backend == 'memory':
+        return MemoryBucketStore()
+    if backend.startswith('sqlite:///'):
+        return SQLiteBucketStore(backend[len('sqlite:///'):])
+    raise ValueError(f"Unsupported rate limit backend: {backend}")
+
+
+class RateLimiter:
+    """Per-tenant token bucket"""
+
+    def __init__(self, store, default_rate=10.0, default_burst=20):
+        self.store = store
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+
+    def check(self, tenant_id, rate=None, burst=None, cost=1):
+        """Raise RateLimitExceeded when the tenant has no tokens left"""
+        rate = self.default_rate if rate is None else float(rate)
+        burst = self.default_burst if burst is None else float(burst)
+        if rate <= 0:
+            return
+        wait = self.store.take(f"tenant:{tenant_id}", rate, max(burst, cost), cost)
+        if wait:
+            raise RateLimitExceeded(max(1, math.ceil(wait)))
+
+
+class FairAdmission:
+    """Weighted fair admission of in-flight Rasa calls.
+
+    At most `capacity` calls run at once in this process. While several tenants
+    are active, each one may use a share of the capacity proportional to its
+    weight, and never more than its own `max_concurrent`. Callers wait at most
+    `queue_timeout` seconds for a slot and are rejected after that.
+    """
+
+    def __init__(self, capacity, queue_timeout=0.5):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._tenants = {}
+        self._condition = threading.Condition()
+
+    def _share(self, tenant_id):
+        active = sum(state['weight'] for state in self._tenants.values())
+        state = self._tenants[tenant_id]
+        share = max(1, math.floor(self.capacity * state['weight'] / active)) if active else self.capacity
+        if state['max_concurrent']:
+            share = min(share, state['max_concurrent'])
+        return share
+
+    @contextmanager
+    def slot(self, tenant_id, weight=1.0, max_concurrent=None):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            state = self._tenants.setdefault(tenant_id, {'in_flight': 0, 'waiting': 0, 'weight': weight,
+                                                         'max_concurrent': max_concurrent})
+            state['weight'] = weight
+            state['max_concurrent'] = max_concurrent
+            state['waiting'] += 1
+            admitted = False
+            try:
+                while self.in_flight >= self.capacity or state['in_flight'] >= self._share(tenant_id):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise RateLimitExceeded(1)
+                    self._condition.wait(remaining)
+                admitted = True
+            finally:
+                state['waiting'] -= 1
+                if not admitted and not state['in_flight'] and not state['waiting']:
+                    # An idle tenant no longer takes part in the weighted shares
+                    del self._tenants[tenant_id]
+                    self._condition.notify_all()
+            state['in_flight'] += 1
+            self.in_flight += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                state['in_flight'] -= 1
+                self.in_flight -= 1
+                if not state['in_flight'] and not state['waiting']:
+                    del self._tenants[tenant_id]
+                self._condition.notify_all()
+
+    def stats(self, per_tenant=False):
+        with self._condition:
+            stats = {
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'rejected': self.rejected,
+                'active_tenants': len(self._tenants)
+            }
+            if per_tenant:
+                stats['tenants'] = {tenant_id: state['in_flight'] for tenant_id, state in self._tenants.items()}
+            return stats
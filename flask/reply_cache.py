@@ -0,0 +1,140 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import zip_longest
+
+from persian import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Entity annotations in training examples: [text](entity) or [text]{"entity": ...}
+_ANNOTATION = re.compile(r'\[([^\]]+)\](\([^)]*\)|\{[^}]*\})')
+
+
+def load_nlu_examples(path):
+    """Map normalised training examples to their intent, read from a Rasa nlu.yml file"""
+    phrases = {}
+    intent = None
+    in_examples = False
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            stripped = line.strip()
+            if stripped.startswith('- intent:'):
+                intent = stripped.split(':', 1)[1].strip()
+                in_examples = False
+            elif stripped.startswith('examples:'):
+                in_examples = intent is not None
+            elif in_examples and stripped.startswith('- '):
+                text = normalize_text(_ANNOTATION.sub(r'\1', stripped[2:]))
+                if text:
+                    phrases.setdefault(text, intent)
+            elif stripped and not line.startswith((' ', '\t')):
+                intent = None
+                in_examples = False
+    return phrases
+
+
+def sample_nlu_examples(path, count):
+    """Up to `count` training examples from a Rasa nlu.yml file, taking one of each intent in turn"""
+    if count <= 0 or not os.path.exists(path):
+        return []
+    by_intent = {}
+    for text, intent in load_nlu_examples(path).items():
+        by_intent.setdefault(intent, []).append(text)
+    samples = []
+    for texts in zip_longest(*by_intent.values()):
+        samples.extend(text for text in texts if text is not None)
+    return samples[:count]
+
+
+class ReplyCache:
+    """LRU/TTL cache of Rasa replies for stateless intents, keyed on tenant and normalised text.
+
+    Only messages that match a training example of a known intent are cacheable,
+    and every entry is dropped when the Rasa model changes.
+    """
+
+    def __init__(self, ttl=3600, max_size=10000, model_probe=None, model_check_interval=30):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.model_probe = model_probe
+        self.model_check_interval = model_check_interval
+        self.model_id = None
+        self.phrases = {}
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._last_model_check = 0.0
+        self._lock = threading.Lock()
+
+    def load_phrases(self, nlu_path):
+        if not os.path.exists(nlu_path):
+            logger.warning(f"NLU file {nlu_path} not found, reply cache has no cacheable phrases")
+            return
+        self.phrases = load_nlu_examples(nlu_path)
+        logger.info(f"Reply cache loaded {len(self.phrases)} cacheable phrases")
+
+    def intent_for(self, normalized_text):
+        """Intent of a known training example, or None"""
+        return self.phrases.get(normalized_text)
+
+    def get(self, tenant_id, normalized_text):
+        self._check_model()
+        key = (tenant_id, normalized_text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, tenant_id, normalized_text, responses):
+        key = (tenant_id, normalized_text)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, responses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set_model(self, model_id):
+        """Record the loaded Rasa model; a different model invalidates every entry"""
+        with self._lock:
+            if model_id and model_id != self.model_id:
+                if self.model_id is not None:
+                    logger.info(f"Rasa model changed to {model_id}, clearing reply cache")
+                self._entries.clear()
+                self.model_id = model_id
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_model(self):
+        if self.model_probe is None:
+            return
+        now = time.monotonic()
+        if now - self._last_model_check < self.model_check_interval:
+            return
+        self._last_model_check = now
+        model_id = self.model_probe()
+        if model_id:
+            self.set_model(model_id)
+        else:
+            # Model state unknown (Rasa down or unreachable): do not serve possibly stale replies
+            self.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'model': self.model_id
+            }
@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+from rasa_client import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobQueue:
+    """In-process pool of worker threads that run `handler(job_id)` for queued reply jobs.
+
+    Job state itself lives in the database, so any process can answer a status
+    poll; waiters in this process are woken as soon as a job finishes here.
+    """
+
+    def __init__(self, handler, workers=8, max_queue=1000):
+        self.handler = handler
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+
+    def submit(self, job_id):
+        """Queue a job; raises queue.Full when the backlog is at capacity"""
+        self._ensure_started()
+        self._queue.put_nowait(job_id)
+
+    def _ensure_started(self):
+        # Started lazily, and again after fork, since threads do not survive fork()
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if not self._threads or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'reply-worker-{index}', daemon=True)
+                    for index in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            try:
+                self.handler(job_id)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing reply job {job_id}: {str(e)}")
+            finally:
+                self.notify(job_id)
+
+    def subscribe(self, job_id):
+        """Event set when `job_id` finishes in this process; pair with unsubscribe()"""
+        event = threading.Event()
+        with self._waiters_lock:
+            self._waiters.setdefault(job_id, []).append(event)
+        return event
+
+    def unsubscribe(self, job_id, event):
+        with self._waiters_lock:
+            events = self._waiters.get(job_id, [])
+            if event in events:
+                events.remove(event)
+            if not events:
+                self._waiters.pop(job_id, None)
+
+    def notify(self, job_id):
+        with self._waiters_lock:
+            events = self._waiters.pop(job_id, [])
+        for event in events:
+            event.set()
+
+    def close(self, timeout=10):
+        """Let the workers finish the queued jobs, then stop them"""
+        if not self._threads or self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize(),
+            'processed': self.processed,
+            'failed': self.failed
+        }
+
+
+def sign_payload(body, secret):
+    """Hex HMAC-SHA256 of the callback body, sent as X-Chatbot-Signature"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def deliver_callback(url, payload, secret=None, timeout=5.0, retries=2):
+    """POST a finished job to the tenant's callback URL; returns True once it is accepted"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Chatbot-Signature'] = sign_payload(body, secret)
+
+    for attempt in range(retries + 1):
+        try:
+            response = requests.post(url, data=body, headers=headers, timeout=timeout)
+            if response.status_code < 500:
+                if response.status_code >= 400:
+                    logger.warning(f"Callback {url} rejected job {payload.get('job_id')}: {response.status_code}")
+                return response.status_code < 400
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Callback {url} failed (attempt {attempt + 1}): {str(e)}")
+        if attempt < retries:
+            time.sleep(backoff_delay(attempt, base=0.5, cap=5.0))
+    return False
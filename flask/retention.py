@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Retention, archival and compaction for the chatbot databases.
+
+    python retention.py run [--tenant ID] [--batch-size 1000] [--sleep 0.1] [--max-seconds 600] [--dry-run]
+    python retention.py compact [--pages 1000] [--convert]
+
+`run` applies each tenant's policy (`close_after_days` and `archive_after_days`
+in its config, with RETENTION_* environment defaults): idle conversations are
+closed, and messages older than the archive horizon are moved into gzipped
+NDJSON segments under ARCHIVE_DIR. Old Rasa trackers are pruned as well. All
+work is done in small committed batches, so an interrupted run is resumed by
+running it again.
+
+`compact` returns the freed pages to the filesystem with incremental vacuum.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+from archive import write_segment
+from storage import get_engine
+
+logger = logging.getLogger('retention')
+
+# Policy defaults; 0 disables a step. Tenants override them in their config.
+RETENTION_CLOSE_AFTER_DAYS = float(os.environ.get('RETENTION_CLOSE_AFTER_DAYS', 30))
+RETENTION_ARCHIVE_AFTER_DAYS = float(os.environ.get('RETENTION_ARCHIVE_AFTER_DAYS', 0))
+# Rasa trackers whose last event is older than this are deleted from the tracker store
+RETENTION_TRACKER_DAYS = float(os.environ.get('RETENTION_TRACKER_DAYS', 0))
+RASA_TRACKER_DB = os.environ.get('RASA_TRACKER_DB', 'data/rasa.db')
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'data/archive')
+
+
+class Budget:
+    """Time budget and throttling shared by every batch of one run"""
+
+    def __init__(self, max_seconds=None, sleep=0.0):
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.sleep = sleep
+
+    def exhausted(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def pause(self):
+        if self.sleep:
+            time.sleep(self.sleep)
+
+
+def tenant_policy(tenant):
+    """(close_after_days, archive_after_days) from the tenant's config"""
+    try:
+        config = json.loads(tenant.config) if tenant.config else {}
+    except ValueError:
+        config = {}
+    if not isinstance(config, dict):
+        config = {}
+    return (
+        float(config.get('close_after_days', RETENTION_CLOSE_AFTER_DAYS) or 0),
+        float(config.get('archive_after_days', RETENTION_ARCHIVE_AFTER_DAYS) or 0)
+    )
+
+
+def close_idle_conversations(api, tenant, days, batch_size, budget, dry_run=False):
+    """Mark active conversations without activity for `days` as closed"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    idle = select(api.Conversation.id).where(
+        api.Conversation.tenant_id == tenant.id,
+        api.Conversation.status == 'active',
+        api.Conversation.updated_at < cutoff
+    )
+    closed = 0
+    while not budget.exhausted():
+        session = api.Session()
+        try:
+            if dry_run:
+                return session.query(api.Conversation).filter(api.Conversation.id.in_(idle)).count()
+            ids = session.scalars(idle.limit(batch_size)).all()
+            if not ids:
+                break
+            session.query(api.Conversation).filter(api.Conversation.id.in_(ids)) \
+                .update({'status': 'closed'}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        closed += len(ids)
+        budget.pause()
+    return closed
+
+
+def archive_messages(api, tenant, days, batch_size, budget, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """Move messages older than `days` into archive segments, one segment per batch"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    Message, Conversation, User = api.Message, api.Conversation, api.User
+    # Same columns as the export path, so archived rows can be merged back into exports
+    old = (
+        select(
+            Message.id, Conversation.conversation_id, User.user_id, Conversation.status,
+            Message.sender, Message.content, Message.intent, Message.confidence, Message.created_at
+        )
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .outerjoin(User, Conversation.user_id == User.id)
+        .where(Conversation.tenant_id == tenant.id, Message.created_at < cutoff)
+        .order_by(Message.id)
+    )
+    archived = 0
+    while not budget.exhausted():
+        session = api.Session()
+        try:
+            if dry_run:
+                return session.scalar(select(func.count()).select_from(old.subquery()))
+            rows = session.execute(old.limit(batch_size)).all()
+            if not rows:
+                break
+            # The segment is durable before the rows are deleted; if we stop in between,
+            # the next run writes them again and readers drop the duplicate ids
+            write_segment(archive_dir, tenant.tenant_id, rows)
+            session.query(Message).filter(Message.id.in_([row[0] for row in rows])) \
+                .delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        archived += len(rows)
+        budget.pause()
+    return archived
+
+
+def prune_trackers(path, days, batch_size, budget, dry_run=False):
+    """Delete Rasa trackers (all events of a sender) whose last event is older than `days`"""
+    if not os.path.exists(path):
+        logger.info(f"Tracker store {path} not found, skipping")
+        return 0
+    engine = get_engine(f"sqlite:///{path}")
+    cutoff = time.time() - days * 86400
+    stale = "SELECT sender_id FROM events GROUP BY sender_id HAVING MAX(timestamp) < :cutoff"
+    with engine.connect() as connection:
+        if not connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'")).first():
+            return 0
+        if dry_run:
+            return connection.execute(text(f"SELECT COUNT(*) FROM ({stale})"), {'cutoff': cutoff}).scalar()
+
+    pruned = 0
+    while not budget.exhausted():
+        with engine.begin() as connection:
+            senders = connection.execute(
+                text(f"{stale} LIMIT :limit"), {'cutoff': cutoff, 'limit': batch_size}
+            ).scalars().all()
+            if not senders:
+                break
+            connection.execute(
+                text("DELETE FROM events WHERE sender_id IN (SELECT value FROM json_each(:senders))"),
+                {'senders': json.dumps(senders)}
+            )
+        pruned += len(senders)
+        budget.pause()
+    return pruned
+
+
+def incremental_vacuum(engine, pages, budget, convert=False):
+    """Release free pages of a SQLite database in steps of `pages`; returns the pages released"""
+    if engine.dialect.name != 'sqlite':
+        logger.info(f"{engine.url} is not SQLite, leaving compaction to the database server")
+        return 0
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            if not convert:
+                logger.warning(f"{engine.url.database} does not use incremental auto_vacuum; "
+                               f"run 'compact --convert' once (rewrites the whole file)")
+                return 0
+            logger.info(f"Converting {engine.url.database} to incremental auto_vacuum")
+            connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+
+        released = 0
+        while not budget.exhausted():
+            free = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free:
+                break
+            connection.exec_driver_sql(f"PRAGMA incremental_vacuum({min(free, pages)})")
+            released += min(free, pages)
+            budget.pause()
+        return released
+
+
+def run(args):
+    import app as api
+    api.init_db()
+
+    budget = Budget(args.max_seconds, args.sleep)
+    session = api.Session()
+    try:
+        query = session.query(api.Tenant)
+        if args.tenant:
+            query = query.filter(api.Tenant.tenant_id == args.tenant)
+        tenants = query.order_by(api.Tenant.id).all()
+    finally:
+        session.close()
+
+    for tenant in tenants:
+        close_days, archive_days = tenant_policy(tenant)
+        if close_days and not budget.exhausted():
+            closed = close_idle_conversations(api, tenant, close_days, args.batch_size, budget, args.dry_run)
+            logger.info(f"{tenant.tenant_id}: {'would close' if args.dry_run else 'closed'} {closed} conversations idle for {close_days:g} days")
+        if archive_days and not budget.exhausted():
+            archived = archive_messages(api, tenant, archive_days, args.batch_size, budget,
+                                        archive_dir=args.archive_dir, dry_run=args.dry_run)
+            logger.info(f"{tenant.tenant_id}: {'would archive' if args.dry_run else 'archived'} {archived} messages older than {archive_days:g} days")
+
+    if RETENTION_TRACKER_DAYS and not args.tenant and not budget.exhausted():
+        pruned = prune_trackers(RASA_TRACKER_DB, RETENTION_TRACKER_DAYS, args.batch_size, budget, args.dry_run)
+        logger.info(f"Rasa tracker store: {'would delete' if args.dry_run else 'deleted'} {pruned} trackers idle for {RETENTION_TRACKER_DAYS:g} days")
+
+    if budget.exhausted():
+        logger.info("Time budget used up; run again to continue")
+
+
+def compact(args):
+    budget = Budget(args.max_seconds, args.sleep)
+    databases = [os.environ.get('DATABASE_URI', 'sqlite:///data/chatbot.db')]
+    if os.path.exists(RASA_TRACKER_DB):
+        databases.append(f"sqlite:///{RASA_TRACKER_DB}")
+    for uri in databases:
+        released = incremental_vacuum(get_engine(uri), args.pages, budget, args.convert)
+        logger.info(f"{uri}: released {released} pages")
+
+
+def main():
+    throttle = argparse.ArgumentParser(add_help=False)
+    throttle.add_argument('--sleep', type=float, default=0.1, help='pause between batches, in seconds')
+    throttle.add_argument('--max-seconds', type=float, help='stop after this long; rerun to continue')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', parents=[throttle],
+                                     help='close idle conversations, archive old messages, prune trackers')
+    run_parser.add_argument('--tenant', help='only this tenant ID')
+    run_parser.add_argument('--batch-size', type=int, default=1000)
+    run_parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    run_parser.add_argument('--dry-run', action='store_true', help='only count what would change')
+    run_parser.set_defaults(handler=run)
+
+    compact_parser = commands.add_parser('compact', parents=[throttle], help='return free pages to the filesystem')
+    compact_parser.add_argument('--pages', type=int, default=1000, help='pages released per step')
+    compact_parser.add_argument('--convert', action='store_true',
+                                help='switch a database to incremental auto_vacuum first (full VACUUM)')
+    compact_parser.set_defaults(handler=compact)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
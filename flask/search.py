@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Full-text search over message content with an SQLite FTS5 index.
+
+    python search.py rebuild [--full] [--batch-size 5000] [--sleep 0] [--max-seconds 600]
+
+The index `message_search` holds each message in normalised form (see
+persian.normalize_text) together with a token for its tenant. Triggers on
+`messages` keep it in sync with every write path. `rebuild` indexes the
+messages written before the index existed; it can be interrupted and run
+again, and --full drops and recreates the index contents first.
+"""
+
+import argparse
+import logging
+import os
+import re
+
+from sqlalchemy import DateTime, text
+
+from persian import tokenize
+from storage import get_engine
+
+logger = logging.getLogger('search')
+
+SEARCH_TABLE = 'message_search'
+# Never produced by normalize_text, so they cannot clash with indexed text
+HIGHLIGHT = ('«', '»')
+
+_DDL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(tenant, content, tokenize = 'unicode61')""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_search_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, tenant, content)
+        SELECT new.id, 't' || tenant_id, persian_normalize(new.content) FROM conversations WHERE id = new.conversation_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_search_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_search_update AFTER UPDATE OF content ON messages BEGIN
+        UPDATE {SEARCH_TABLE} SET content = persian_normalize(new.content) WHERE rowid = new.id;
+    END""",
+)
+
+_TERMS = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def install(engine):
+    """Create the index and its triggers; returns False when the database cannot host them"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.begin() as connection:
+        if not connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar():
+            logger.warning("SQLite was built without FTS5, message search is disabled")
+            return False
+        exists = connection.exec_driver_sql(
+            f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{SEARCH_TABLE}'"
+        ).first()
+        for statement in _DDL:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            # Rank on content only; the tenant column is just a filter
+            connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(0.0, 1.0)')")
+            if connection.exec_driver_sql("SELECT 1 FROM messages LIMIT 1").first():
+                logger.warning("Created the message search index; run 'python search.py rebuild' to index existing messages")
+    return True
+
+
+def match_expression(tenant_pk, query):
+    """FTS5 query for `query` within one tenant, or None when it has no searchable terms.
+
+    Bare words must all occur and text in double quotes must occur as a
+    phrase; a word ending in * matches any word it is a prefix of.
+    """
+    terms = []
+    for phrase, word in _TERMS.findall(query):
+        tokens = tokenize(phrase or word.rstrip('*'))
+        if tokens:
+            terms.append('"' + ' '.join(tokens) + '"' + ('*' if word.endswith('*') else ''))
+    if not terms:
+        return None
+    return f"tenant : t{int(tenant_pk)} AND content : ({' '.join(terms)})"
+
+
+def search(connection, tenant_pk, match, limit, cursor=None, conversation_id=None, snippet_tokens=12):
+    """One page of matching messages, best first, and the (rank, id) of the last row when more follow"""
+    conditions = [f"{SEARCH_TABLE} MATCH :match", "c.tenant_id = :tenant"]
+    params = {'match': match, 'tenant': tenant_pk, 'limit': limit + 1}
+    if conversation_id is not None:
+        conditions.append("c.conversation_id = :conversation_id")
+        params['conversation_id'] = conversation_id
+    if cursor is not None:
+        conditions.append(f"({SEARCH_TABLE}.rank > :rank OR ({SEARCH_TABLE}.rank = :rank AND {SEARCH_TABLE}.rowid > :after_id))")
+        params['rank'], params['after_id'] = cursor
+
+    rows = connection.execute(text(f"""
+        SELECT m.id, c.conversation_id, m.sender, m.content, m.created_at,
+               snippet({SEARCH_TABLE}, 1, '{HIGHLIGHT[0]}', '{HIGHLIGHT[1]}', '…', {int(snippet_tokens)}) AS snippet,
+               {SEARCH_TABLE}.rank AS rank
+        FROM {SEARCH_TABLE}
+        JOIN messages m ON m.id = {SEARCH_TABLE}.rowid
+        JOIN conversations c ON c.id = m.conversation_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {SEARCH_TABLE}.rank, {SEARCH_TABLE}.rowid
+        LIMIT :limit
+    """).columns(created_at=DateTime), params).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1].rank, rows[-1].id)
+
+
+def rebuild(engine, batch_size, budget, full=False):
+    """Index messages missing from the index, walking `messages` in id order one committed batch at a time"""
+    if full:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE}")
+    batch_end = text("SELECT MAX(id) FROM (SELECT id FROM messages WHERE id > :after_id ORDER BY id LIMIT :limit)")
+    # Rows written since the triggers were installed are already indexed and skipped
+    fill = text(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, tenant, content)
+        SELECT m.id, 't' || c.tenant_id, persian_normalize(m.content)
+        FROM messages m JOIN conversations c ON c.id = m.conversation_id
+        WHERE m.id > :after_id AND m.id <= :last_id
+          AND NOT EXISTS (SELECT 1 FROM {SEARCH_TABLE} WHERE rowid = m.id)
+    """)
+    indexed = 0
+    after_id = 0
+    while not budget.exhausted():
+        with engine.begin() as connection:
+            last_id = connection.execute(batch_end, {'after_id': after_id, 'limit': batch_size}).scalar()
+            if last_id is None:
+                connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+                break
+            indexed += connection.execute(fill, {'after_id': after_id, 'last_id': last_id}).rowcount
+        after_id = last_id
+        budget.pause()
+    return indexed
+
+
+def main():
+    from retention import Budget
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = commands.add_parser('rebuild', help='index messages that are not in the search index yet')
+    rebuild_parser.add_argument('--full', action='store_true', help='clear the index and index every message again')
+    rebuild_parser.add_argument('--batch-size', type=int, default=5000)
+    rebuild_parser.add_argument('--sleep', type=float, default=0.0, help='pause between batches, in seconds')
+    rebuild_parser.add_argument('--max-seconds', type=float, help='stop after this long; rerun to continue')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    engine = get_engine(os.environ.get('DATABASE_URI', 'sqlite:///data/chatbot.db'))
+    if not install(engine):
+        raise SystemExit("Message search needs an SQLite database with FTS5")
+    indexed = rebuild(engine, args.batch_size, Budget(args.max_seconds, args.sleep), full=args.full)
+    logger.info(f"Indexed {indexed} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Production launcher: serves the app from app.create_app() with gunicorn.
+
+    python server.py [gunicorn options]
+    gunicorn --config server.py 'app:create_app()'
+
+This file is also the gunicorn configuration. Every setting can be set with
+an environment variable:
+
+    SERVER_BIND                 address to listen on (0.0.0.0:8000)
+    SERVER_WORKER_CLASS         gevent, gthread or sync (gevent)
+    SERVER_WORKERS              worker processes (CPU count for gevent, 2 x CPU + 1 otherwise)
+    SERVER_THREADS              threads per worker (4 for gthread, else 1)
+    SERVER_WORKER_CONNECTIONS   concurrent requests per gevent worker (1000)
+    SERVER_PRELOAD              import the app once in the master before forking (true)
+    SERVER_MAX_REQUESTS         recycle a worker after this many requests, 0 = never (10000)
+    SERVER_MAX_REQUESTS_JITTER  random extra requests, so workers do not recycle together (1000)
+    SERVER_TIMEOUT              seconds before a silent worker is killed (30)
+    SERVER_GRACEFUL_TIMEOUT     seconds a stopping worker has to finish its requests (30)
+    SERVER_KEEPALIVE            seconds to keep idle client connections open (5)
+
+SIGHUP reloads tenants and replaces the workers without dropping requests;
+SIGTERM stops accepting connections and drains the workers.
+"""
+
+import gc
+import multiprocessing
+import os
+import sys
+
+
+def _flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+worker_class = os.environ.get('SERVER_WORKER_CLASS', 'gevent')
+preload_app = _flag('SERVER_PRELOAD', True)
+
+# The gevent workers patch the standard library only after the fork, which is too late for
+# the locks and queues a preloaded app creates at import; patch the master before it loads
+if worker_class == 'gevent' and preload_app:
+    from gevent import monkey
+    monkey.patch_all()
+
+_cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('SERVER_BIND', '0.0.0.0:8000')
+# gevent workers multiplex I/O in one process, so one per CPU; blocking workers need spares
+workers = int(os.environ.get('SERVER_WORKERS', 0)) or (_cpus if worker_class == 'gevent' else 2 * _cpus + 1)
+# More than one thread turns sync workers into gthread workers, so only gthread gets a default
+threads = int(os.environ.get('SERVER_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(os.environ.get('SERVER_WORKER_CONNECTIONS', 1000))
+max_requests = int(os.environ.get('SERVER_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 1000))
+timeout = int(os.environ.get('SERVER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('SERVER_KEEPALIVE', 5))
+accesslog = os.environ.get('SERVER_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('SERVER_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Sync the tenants file in the preloaded master, so no worker hashes keys or writes the tenants table"""
+    if server.cfg.preload_app:
+        import app as api
+        if api.app.config['TENANTS_AUTOLOAD']:
+            api.load_tenants()
+
+
+def post_fork(server, worker):
+    """Give the new worker its own database connections and HTTP pools"""
+    import app as api
+    api.after_fork()
+
+
+def post_worker_init(worker):
+    """Start the worker's background threads once its app is loaded (and, without preload, its schema created)"""
+    import app as api
+    api.start_background_tasks()
+
+
+def worker_exit(server, worker):
+    """Flush queued message writes and finish queued reply jobs before the worker exits"""
+    import app as api
+    api.drain()
+
+
+def on_reload(server):
+    """Reload tenants in the master so the workers forked by SIGHUP start with the new registry"""
+    if server.cfg.preload_app:
+        import app as api
+        api.load_tenants()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        # Keep the collector from touching (and so un-sharing) the pages the preloaded app lives in
+        gc.freeze()
+    server.log.info(f"Serving with {server.cfg.workers} {server.cfg.worker_class_str} workers "
+                    f"(preload={server.cfg.preload_app}, max_requests={server.cfg.max_requests})")
+
+
+def main():
+    from gunicorn.app.wsgiapp import run
+
+    sys.argv = [sys.argv[0], '--config', os.path.abspath(__file__)] + sys.argv[1:] + ['app:create_app()']
+    run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Startup profiler: where the API process spends time and memory before it serves.
+
+    python startup_profile.py [--top 25] [--output startup.json]
+
+Imports the app with every module import timed, then runs create_app() and
+one request to /health. It reports the time and resident memory of each
+phase and the modules with the highest import cost. Time is given as
+inclusive (with the imports it triggered) and self, and memory as the growth
+of RSS while the module was executing. Run it in a fresh process, since
+modules that are already imported cost nothing.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current RSS where /proc is unavailable (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _TimedLoader:
+    """Wraps a module loader to time exec_module"""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.measure(module.__name__):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportProfiler:
+    """Meta path hook recording inclusive/self import time and RSS growth per module"""
+
+    def __init__(self):
+        self.modules = {}
+        self._stack = []
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def measure(self, name):
+        profiler = self
+
+        class _Measure:
+            def __enter__(self):
+                profiler._stack.append([time.perf_counter(), current_rss(), 0.0])
+
+            def __exit__(self, *exc_info):
+                start, rss, children = profiler._stack.pop()
+                elapsed = time.perf_counter() - start
+                if profiler._stack:
+                    profiler._stack[-1][2] += elapsed
+                profiler.modules[name] = {
+                    'inclusive_ms': elapsed * 1000,
+                    'self_ms': (elapsed - children) * 1000,
+                    'rss_kb': (current_rss() - rss) // 1024
+                }
+
+        return _Measure()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=25, help='modules to list')
+    parser.add_argument('--sort', choices=('self_ms', 'inclusive_ms', 'rss_kb'), default='self_ms')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    phases = []
+    started = time.perf_counter()
+
+    def phase(name):
+        phases.append({'phase': name, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+                       'rss_mb': round(current_rss() / 2 ** 20, 1)})
+
+    phase('interpreter')
+    profiler = ImportProfiler()
+    profiler.install()
+    import app as api
+    profiler.uninstall()
+    phase('import app')
+
+    application = api.create_app()
+    phase('create_app')
+
+    response = application.test_client().get('/health')
+    phase(f"first request (/health {response.status_code})")
+
+    print(f"{'phase':<32} {'elapsed ms':>11} {'rss MB':>8}")
+    for entry in phases:
+        print(f"{entry['phase']:<32} {entry['elapsed_ms']:>11} {entry['rss_mb']:>8}")
+
+    ranked = sorted(profiler.modules.items(), key=lambda item: item[1][args.sort], reverse=True)[:args.top]
+    print(f"\n{'module':<40} {'self ms':>9} {'incl ms':>9} {'rss KB':>8}")
+    for name, cost in ranked:
+        print(f"{name:<40} {cost['self_ms']:>9.1f} {cost['inclusive_ms']:>9.1f} {cost['rss_kb']:>8}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'phases': phases, 'modules': profiler.modules}, file, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
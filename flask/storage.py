@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.pool import QueuePool
+
+from persian import normalize_text
+
+# SQLite tuning, applied to every new DBAPI connection
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# Only takes effect for new database files; existing ones are converted by `retention.py compact --convert`
+SQLITE_AUTO_VACUUM = os.environ.get('SQLITE_AUTO_VACUUM', 'INCREMENTAL')
+
+# Connection pool sizing (used for both SQLite files and server databases)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+logger = logging.getLogger(__name__)
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA auto_vacuum = {SQLITE_AUTO_VACUUM}")
+    cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+    # Used by the message search triggers (see search.py)
+    dbapi_connection.create_function('persian_normalize', 1, _persian_normalize, deterministic=True)
+
+
+def _persian_normalize(value):
+    return normalize_text(value) if value else ''
+
+
+def create_storage_engine(uri):
+    """Create an engine tuned for the backend in `uri` (SQLite profile or pooled server database)"""
+    url = make_url(uri)
+
+    if url.get_backend_name() == 'sqlite':
+        if _is_memory_sqlite(url):
+            engine = create_engine(url)
+        else:
+            if url.database and os.path.dirname(url.database):
+                os.makedirs(os.path.dirname(url.database), exist_ok=True)
+            engine = create_engine(
+                url,
+                poolclass=QueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+            )
+        event.listen(engine, 'connect', _sqlite_pragmas)
+        return engine
+
+    return create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
+
+def get_engine(uri):
+    """Process-wide engine for `uri`; callers using the same URI share one pool"""
+    engine = _engines.get(uri)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(uri)
+            if engine is None:
+                engine = create_storage_engine(uri)
+                _engines[uri] = engine
+    return engine
+
+
+def add_missing_columns(engine, metadata):
+    """ALTER TABLE ... ADD COLUMN for nullable model columns added after their table was created"""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            try:
+                with engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+                    )
+                logger.info(f"Added column {table.name}.{column.name}")
+            except DatabaseError as e:
+                # Another process may have added it first
+                logger.debug(f"Could not add column {table.name}.{column.name}: {str(e)}")
+
+
+def convert_column_type(engine, table, column_name):
+    """Convert an existing column to the type the model now declares (e.g. text to float), keeping its values.
+
+    SQLite cannot change a column type in place, so the table is rebuilt: it is
+    renamed, created again from the model and refilled in one transaction. Its
+    triggers go with the old table and must be created again.
+    """
+    column = table.c[column_name]
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return False
+    current = {entry['name']: entry['type'] for entry in inspector.get_columns(table.name)}.get(column_name)
+    if current is None or _python_type(current) is _python_type(column.type):
+        return False
+
+    preparer = engine.dialect.identifier_preparer
+    name, target = preparer.format_table(table), column.type.compile(engine.dialect)
+    quoted = preparer.format_column(column)
+    converted = f"CAST(NULLIF({quoted}, '') AS {target})"
+    logger.warning(f"Converting {table.name}.{column_name} from {current} to {target}")
+
+    if engine.dialect.name != 'sqlite':
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"ALTER TABLE {name} ALTER COLUMN {quoted} TYPE {target} USING {converted}")
+        return True
+
+    with engine.begin() as connection:
+        # Take the write lock first; another process may have converted the table meanwhile
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        declared = connection.exec_driver_sql(f"SELECT type FROM pragma_table_info('{table.name}') WHERE name = '{column_name}'").scalar()
+        if declared.upper() == target.upper():
+            return False
+        old = preparer.quote(f"{table.name}_old")
+        connection.exec_driver_sql(f"ALTER TABLE {name} RENAME TO {old}")
+        # Index names are global in SQLite; free them for the indexes of the new table
+        indexes = connection.exec_driver_sql(
+            f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = '{table.name}_old' AND sql IS NOT NULL"
+        ).scalars().all()
+        for index in indexes:
+            connection.exec_driver_sql(f"DROP INDEX {preparer.quote(index)}")
+        table.create(connection)
+        columns = [preparer.format_column(entry) for entry in table.columns]
+        values = [converted if entry.name == column_name else preparer.format_column(entry) for entry in table.columns]
+        connection.exec_driver_sql(f"INSERT INTO {name} ({', '.join(columns)}) SELECT {', '.join(values)} FROM {old}")
+        connection.exec_driver_sql(f"DROP TABLE {old}")
+    return True
+
+
+def _python_type(column_type):
+    try:
+        return column_type.python_type
+    except NotImplementedError:
+        return None
+
+
+def dispose_engines():
+    """Drop pooled connections inherited from a parent process (call after fork)"""
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
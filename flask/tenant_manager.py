@@ -1,52 +1,355 @@
+import csv
+import hashlib
+import hmac
 import json
+import logging
 import os
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+def _freeze(value):
+    """تبدیل دیکشنری و لیست‌ها به نسخه فقط‌خواندنی"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def key_fingerprint(api_key):
+    """اثر انگشت سریع کلید API برای تشخیص تغییر کلید بدون محاسبه مجدد هش PBKDF2"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def _check_key(pair):
+    return check_password_hash(*pair)
+
+
+def _map(function, items, workers):
+    """اجرای تابع روی آیتم‌ها، در صورت workers > 1 به صورت موازی روی چند پروسس"""
+    if workers <= 1 or len(items) < 2:
+        return [function(item) for item in items]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, items, chunksize=max(1, len(items) // (workers * 4))))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _parse_config(value):
+    """خواندن تنظیمات که ممکن است رشته JSON یا دیکشنری باشد"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return value
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
 
 class TenantManager:
-    def __init__(self, tenants_file_path=None):
-        """مدیریت اطلاعات مستاجرها"""
+    def __init__(self, tenants_file_path=None, session_factory=None, tenant_model=None,
+                 on_change=None, autoload=True):
+        """مدیریت اطلاعات مستاجرها
+
+        فایل مستاجرها (CSV یا JSON) خوانده می‌شود، در صورت تعیین session_factory
+        با جدول tenants همگام می‌شود و یک ایندکس فقط‌خواندنی در حافظه نگه داشته می‌شود.
+        refresh ایندکس را فقط از جدول می‌سازد؛ پروسس‌های سرور از آن استفاده می‌کنند
+        و همگام‌سازی فایل (و هش کلیدها) به provision_tenants.py یا پروسس اصلی سپرده می‌شود.
+        on_change پس از هر بارگذاری با ردیف‌های جدول و شناسه مستاجرهای تغییرکرده صدا زده می‌شود.
+        """
         if tenants_file_path is None:
             # مسیر پیش‌فرض فایل تنظیمات مستاجرها
             self.tenants_file_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tenants.json')
         else:
             self.tenants_file_path = tenants_file_path
-        
-        self.tenants = {}
-        self.load_tenants()
-    
-    def load_tenants(self):
-        """بارگذاری اطلاعات مستاجرها از فایل JSON"""
-        try:
+
+        self.Session = session_factory
+        self.Tenant = tenant_model
+        self.on_change = on_change
+
+        self.tenants = MappingProxyType({})
+        self._mtime = None
+        # وضعیت جدول در آخرین بارگذاری: (تعداد ردیف‌ها، آخرین updated_at) و (هش کلید، تنظیمات) هر مستاجر
+        self._signature = None
+        self._stored = {}
+        self._load_lock = threading.Lock()
+        self._watcher = None
+
+        if autoload:
+            self.load_tenants()
+
+    def _read_file(self):
+        """خواندن فایل مستاجرها با توجه به پسوند آن"""
+        if self.tenants_file_path.endswith('.csv'):
+            with open(self.tenants_file_path, 'r', encoding='utf-8', newline='') as file:
+                rows = list(csv.DictReader(file))
+        else:
             with open(self.tenants_file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                
-                # ذخیره اطلاعات مستاجرها با کلید tenant_id
-                for tenant in data.get('tenants', []):
-                    tenant_id = tenant.get('id')
-                    if tenant_id:
-                        self.tenants[tenant_id] = tenant
-                
-                print(f"مستاجرها با موفقیت بارگذاری شدند: {len(self.tenants)} مستاجر یافت شد.")
+                rows = json.load(file).get('tenants', [])
+
+        records = {}
+        for row in rows:
+            tenant_id = row.get('tenant_id') or row.get('id')
+            if not tenant_id:
+                continue
+            config = _parse_config(row.get('config')) or _parse_config(row.get('settings'))
+            settings = _parse_config(row.get('settings')) or config
+            records[tenant_id] = {
+                'id': tenant_id,
+                'tenant_id': tenant_id,
+                'name': row.get('name') or tenant_id,
+                'api_key': row.get('api_key'),
+                'config': config,
+                'settings': settings
+            }
+        return records
+
+    def load_tenants(self, workers=1, chunk_size=1000):
+        """بارگذاری اطلاعات مستاجرها از فایل و جایگزینی اتمیک ایندکس
+
+        workers تعداد پروسس‌های محاسبه هش کلیدهاست و درج/به‌روزرسانی در تراکنش‌هایی
+        با حداکثر chunk_size ردیف انجام می‌شود. آمار همگام‌سازی برگردانده می‌شود.
+        """
+        with self._load_lock:
+            try:
+                mtime = os.stat(self.tenants_file_path).st_mtime
+                records = self._read_file()
+
+                stats = None
+                if self.Session is not None:
+                    stats = self._sync(records, workers, chunk_size)
+
+                # ایندکس جدید کامل ساخته می‌شود و سپس در یک انتساب جایگزین می‌شود
+                self.tenants = MappingProxyType({
+                    tenant_id: _freeze(record) for tenant_id, record in records.items()
+                })
+                self._mtime = mtime
+
+                logger.info(f"مستاجرها با موفقیت بارگذاری شدند: {len(self.tenants)} مستاجر یافت شد.")
+                return stats
+            except Exception as e:
+                logger.error(f"خطا در بارگذاری فایل مستاجرها: {str(e)}")
+
+    def _sync(self, records, workers=1, chunk_size=1000):
+        """همگام‌سازی تفاضلی مستاجرها با جدول tenants
+
+        فقط ردیف‌های جدید یا تغییرکرده نوشته می‌شوند. تغییر کلید با اثر انگشت ذخیره‌شده
+        تشخیص داده می‌شود، بنابراین اجرای مجدد بدون تغییر هیچ هش PBKDF2 محاسبه نمی‌کند.
+        """
+        Tenant = self.Tenant
+        started = time.monotonic()
+        session = self.Session()
+        try:
+            existing = {
+                row.tenant_id: row
+                for row in session.query(Tenant.id, Tenant.tenant_id, Tenant.name, Tenant.api_key,
+                                         Tenant.config, Tenant.key_fingerprint)
+            }
+        finally:
+            session.close()
+
+        inserts = []
+        updates = []
+        legacy = []
+        now = datetime.utcnow()
+        for tenant_id, record in records.items():
+            api_key = record['api_key']
+            if not api_key:
+                continue
+            row = {
+                'tenant_id': tenant_id,
+                'name': record['name'],
+                'config': json.dumps(record['config'], ensure_ascii=False, sort_keys=True),
+                'key_fingerprint': key_fingerprint(api_key),
+                # پروسس‌های سرور تغییر جدول را با این ستون تشخیص می‌دهند
+                'updated_at': now
+            }
+            tenant = existing.get(tenant_id)
+            if tenant is None:
+                inserts.append((row, api_key))
+                continue
+
+            row['id'] = tenant.id
+            key_changed = tenant.key_fingerprint is not None and \
+                not hmac.compare_digest(tenant.key_fingerprint, row['key_fingerprint'])
+            if tenant.key_fingerprint is None:
+                # ردیف‌های قدیمی بدون اثر انگشت یک بار با هش ذخیره‌شده مقایسه می‌شوند
+                legacy.append((row, api_key, tenant.api_key))
+            elif key_changed or tenant.name != row['name'] or tenant.config != row['config']:
+                updates.append((row, api_key if key_changed else None))
+
+        matches = _map(_check_key, [(stored_hash, api_key) for _, api_key, stored_hash in legacy], workers)
+        for (row, api_key, _), same_key in zip(legacy, matches):
+            updates.append((row, None if same_key else api_key))
+
+        # محاسبه هش کلیدهای جدید یا تغییرکرده، موازی روی چند پروسس
+        pending = [(row, api_key) for row, api_key in inserts + updates if api_key]
+        hashes = _map(generate_password_hash, [api_key for _, api_key in pending], workers)
+        for (row, _), hashed in zip(pending, hashes):
+            row['api_key'] = hashed
+
+        changed = {row['tenant_id'] for row, _ in inserts + updates}
+        session = self.Session()
+        try:
+            for chunk in _chunks([row for row, _ in inserts], chunk_size):
+                session.bulk_insert_mappings(Tenant, chunk)
+                session.commit()
+            for chunk in _chunks([row for row, _ in updates], chunk_size):
+                session.bulk_update_mappings(Tenant, chunk)
+                session.commit()
+
+            signature = self._read_signature(session)
+            rows = session.query(Tenant.id, Tenant.tenant_id, Tenant.api_key, Tenant.config).all()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        self._remember(rows, signature)
+        if self.on_change is not None:
+            self.on_change(rows, changed)
+
+        return {
+            'tenants': len(records),
+            'inserted': len(inserts),
+            'updated': len(updates),
+            'unchanged': len(records) - len(inserts) - len(updates),
+            'hashed': len(pending),
+            'seconds': round(time.monotonic() - started, 3)
+        }
+
+    def _read_signature(self, session):
+        """تعداد ردیف‌ها و آخرین زمان تغییر جدول tenants؛ با هر درج یا به‌روزرسانی تغییر می‌کند"""
+        Tenant = self.Tenant
+        return tuple(session.query(func.count(Tenant.id), func.max(Tenant.updated_at)).one())
+
+    def _remember(self, rows, signature):
+        self._stored = {row.tenant_id: (row.api_key, row.config) for row in rows}
+        self._signature = signature
+
+    def refresh(self):
+        """بازسازی ایندکس از جدول tenants، بدون خواندن فایل و محاسبه هش کلیدها"""
+        Tenant = self.Tenant
+        with self._load_lock:
+            try:
+                session = self.Session()
+                try:
+                    signature = self._read_signature(session)
+                    rows = session.query(Tenant.id, Tenant.tenant_id, Tenant.name, Tenant.api_key, Tenant.config).all()
+                finally:
+                    session.close()
+
+                records = {}
+                for row in rows:
+                    config = _parse_config(row.config)
+                    # جدول فقط هش کلید را دارد، پس کلید در ایندکس نگه داشته نمی‌شود
+                    records[row.tenant_id] = {
+                        'id': row.tenant_id,
+                        'tenant_id': row.tenant_id,
+                        'name': row.name,
+                        'api_key': None,
+                        'config': config,
+                        'settings': config
+                    }
+                changed = {
+                    row.tenant_id for row in rows
+                    if self._stored.get(row.tenant_id, (row.api_key, row.config)) != (row.api_key, row.config)
+                }
+
+                self.tenants = MappingProxyType({
+                    tenant_id: _freeze(record) for tenant_id, record in records.items()
+                })
+                self._remember(rows, signature)
+                if self.on_change is not None:
+                    self.on_change(rows, changed)
+
+                logger.info(f"مستاجرها از دیتابیس بارگذاری شدند: {len(self.tenants)} مستاجر، {len(changed)} تغییرکرده.")
+                return True
+            except Exception as e:
+                logger.error(f"خطا در بارگذاری مستاجرها از دیتابیس: {str(e)}")
+                return False
+
+    def reload_if_changed(self):
+        """بارگذاری مجدد در صورت تغییر جدول tenants (یا زمان ویرایش فایل وقتی دیتابیسی در کار نیست)"""
+        if self.Session is None:
+            try:
+                mtime = os.stat(self.tenants_file_path).st_mtime
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            self.load_tenants()
+            return True
+
+        session = self.Session()
+        try:
+            signature = self._read_signature(session)
         except Exception as e:
-            print(f"خطا در بارگذاری فایل مستاجرها: {str(e)}")
-    
+            logger.error(f"خطا در بررسی جدول مستاجرها: {str(e)}")
+            return False
+        finally:
+            session.close()
+        if signature == self._signature:
+            return False
+        return self.refresh()
+
+    def start_watching(self, interval=5.0):
+        """بررسی دوره‌ای جدول مستاجرها در یک ترد پس‌زمینه؛ فایل را همگام نمی‌کند"""
+        if self._watcher is not None and self._watcher[1] == os.getpid():
+            return
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                self.reload_if_changed()
+
+        thread = threading.Thread(target=watch, name='tenant-watcher', daemon=True)
+        self._watcher = (stop, os.getpid())
+        thread.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher[0].set()
+            self._watcher = None
+
+    def handle_signal(self, signum=None, frame=None):
+        """بارگذاری مجدد با سیگنال (مثلاً SIGHUP) خارج از handler سیگنال"""
+        threading.Thread(target=self.load_tenants, name='tenant-reload', daemon=True).start()
+
     def get_tenant(self, tenant_id):
         """دریافت اطلاعات یک مستاجر با شناسه"""
         return self.tenants.get(tenant_id)
-    
+
     def verify_api_key(self, tenant_id, api_key):
         """تأیید کلید API مستاجر"""
         tenant = self.get_tenant(tenant_id)
-        if tenant and tenant.get('api_key') == api_key:
-            return True
+        if tenant and tenant.get('api_key') and api_key:
+            return hmac.compare_digest(tenant['api_key'].encode('utf-8'), api_key.encode('utf-8'))
         return False
-    
+
     def get_all_tenants(self):
         """دریافت لیست تمام مستاجرها"""
         return list(self.tenants.values())
-    
+
     def get_tenant_setting(self, tenant_id, setting_key, default_value=None):
         """دریافت تنظیمات خاص یک مستاجر"""
         tenant = self.get_tenant(tenant_id)
         if tenant and 'settings' in tenant:
             return tenant['settings'].get(setting_key, default_value)
-        return default_value
\ No newline at end of file
+        return default_value
@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # فایل مدیریت چت‌بات
-# استفاده: ./manage.sh [start|stop|restart|build|logs|train]
+# استفاده: ./manage.sh [start|stop|restart|build|logs|train|retention|provision|search|analytics]
 
 set -e
 
@@ -44,8 +44,37 @@ case "$1" in
     echo "آموزش مدل با موفقیت انجام شد."
     ;;
     
+  retention)
+    # مثال: ./manage.sh retention run --max-seconds 600 --sleep 0.2
+    # یا: ./manage.sh retention compact --pages 2000
+    echo "اجرای نگهداشت و بایگانی داده‌ها..."
+    shift
+    docker-compose run --rm flask python retention.py "$@"
+    ;;
+    
+  provision)
+    # مثال: ./manage.sh provision --workers 4 --chunk-size 500
+    echo "بارگذاری فروشگاه‌ها از tenants.csv..."
+    shift
+    docker-compose run --rm flask python provision_tenants.py "$@"
+    ;;
+    
+  search)
+    # مثال: ./manage.sh search rebuild --batch-size 5000
+    echo "ساخت ایندکس جستجوی پیام‌ها..."
+    shift
+    docker-compose run --rm flask python search.py "$@"
+    ;;
+    
+  analytics)
+    # مثال: ./manage.sh analytics rebuild --since 2024-05-01
+    echo "شمارش دوباره آمار روزانه پیام‌ها..."
+    shift
+    docker-compose run --rm flask python analytics.py "$@"
+    ;;
+    
   *)
-    echo "استفاده: $0 [start|stop|restart|build|logs|train]"
+    echo "استفاده: $0 [start|stop|restart|build|logs|train|retention|provision|search|analytics]"
     exit 1
     ;;
 esac
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 """
 Script to generate initial tenant data for the chatbot application.
-This creates a CSV file with sample tenant data.
+This creates a CSV file with the sample tenants, plus as many synthetic
+stores with realistic configs as requested:
+
+    python generate_tenants.py --count 5000 --output tenants.csv
+
+Tenants already present in the output file are kept as they are (API key
+and config), so re-generating only adds new stores and provisioning stays
+incremental.
 """
 
 import os
 import csv
 import json
 import uuid
+import random
+import argparse
 import logging
 from datetime import datetime
 
@@ -62,34 +71,88 @@ SAMPLE_TENANTS = [
     }
 ]
 
-def generate_tenant_data():
+# Building blocks for synthetic stores: (store type, English slug, products)
+STORE_CATEGORIES = [
+    ("فروشگاه دیجیتال", "digital", ["موبایل", "لپتاپ", "تبلت", "لوازم جانبی", "هدفون", "ساعت هوشمند"]),
+    ("فروشگاه لباس", "fashion", ["پیراهن", "شلوار", "کفش", "لباس زنانه", "لباس مردانه", "کیف"]),
+    ("لوازم خانگی", "home", ["یخچال", "ماشین لباسشویی", "اجاق گاز", "جاروبرقی", "مایکروویو"]),
+    ("کتاب‌فروشی", "books", ["رمان", "کتاب کودک", "کتاب آموزشی", "لوازم تحریر"]),
+    ("سوپرمارکت", "market", ["لبنیات", "نوشیدنی", "تنقلات", "میوه", "حبوبات"]),
+    ("لوازم آرایشی", "beauty", ["عطر", "کرم", "لوازم آرایش", "محصولات مو"]),
+    ("لوازم ورزشی", "sport", ["کفش ورزشی", "دوچرخه", "لباس ورزشی", "تجهیزات بدنسازی"]),
+]
+STORE_NAMES = ["آریا", "پارس", "نگین", "سپهر", "البرز", "مهرگان", "آسمان", "کوروش", "دماوند", "نوین"]
+BUSINESS_HOURS = ["8:00 - 17:00", "9:00 - 18:00", "9:00 - 21:00", "10:00 - 20:00", "10:00 - 22:00"]
+
+
+def synthesize_tenant(index, rng):
+    """A synthetic store with a realistic config"""
+    store_type, slug, products = rng.choice(STORE_CATEGORIES)
+    tenant_id = f"store{index}"
+    config = {
+        "logo_url": f"https://example.com/{tenant_id}/logo.png",
+        "primary_color": "#{:06X}".format(rng.randrange(0x1000000)),
+        "support_email": f"support@{slug}{index}.example.com",
+        "business_hours": rng.choice(BUSINESS_HOURS),
+        "products": rng.sample(products, rng.randint(2, len(products)))
+    }
+    return {
+        "tenant_id": tenant_id,
+        "name": f"{store_type} {rng.choice(STORE_NAMES)} {index}",
+        "api_key": str(uuid.uuid4()),
+        "config": json.dumps(config, ensure_ascii=False)
+    }
+
+
+def read_existing_tenants(path):
+    """Tenants of a previous tenants file, by tenant ID"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+        return {row['tenant_id']: row for row in csv.DictReader(csvfile) if row.get('api_key')}
+
+
+def generate_tenant_data(count=len(SAMPLE_TENANTS), output_file=OUTPUT_FILE, seed=None):
     """Generate tenant data and write to CSV file"""
     try:
         # Create data directory if it doesn't exist
-        os.makedirs(DATA_DIR, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        
+        rng = random.Random(seed)
+        tenants = SAMPLE_TENANTS[:count] + [
+            synthesize_tenant(index, rng) for index in range(len(SAMPLE_TENANTS) + 1, count + 1)
+        ]
+        existing = read_existing_tenants(output_file)
+        new_tenants = [tenant for tenant in tenants if tenant['tenant_id'] not in existing]
+        tenants = [existing.get(tenant['tenant_id'], tenant) for tenant in tenants]
         
         # Write tenant data to CSV
-        with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as csvfile:
+        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
             fieldnames = ['tenant_id', 'name', 'api_key', 'config']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             
             writer.writeheader()
-            for tenant in SAMPLE_TENANTS:
-                writer.writerow(tenant)
+            writer.writerows(tenants)
         
-        logger.info(f"Successfully generated tenant data at {OUTPUT_FILE}")
-        logger.info(f"Created {len(SAMPLE_TENANTS)} tenant records")
+        logger.info(f"Successfully generated tenant data at {output_file}")
+        logger.info(f"Created {len(tenants)} tenant records ({len(new_tenants)} new)")
         
-        # Print API keys for reference
-        logger.info("API Keys for tenants:")
-        for tenant in SAMPLE_TENANTS:
-            logger.info(f"Tenant: {tenant['name']} (ID: {tenant['tenant_id']})")
-            logger.info(f"API Key: {tenant['api_key']}")
-            logger.info("-" * 40)
+        # Print API keys for reference (only for small batches)
+        if len(new_tenants) <= 10:
+            logger.info("API Keys for new tenants:")
+            for tenant in new_tenants:
+                logger.info(f"Tenant: {tenant['name']} (ID: {tenant['tenant_id']})")
+                logger.info(f"API Key: {tenant['api_key']}")
+                logger.info("-" * 40)
         
     except Exception as e:
         logger.error(f"Error generating tenant data: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    generate_tenant_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=len(SAMPLE_TENANTS), help='number of tenants')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='CSV file to write')
+    parser.add_argument('--seed', type=int, help='random seed for the synthetic configs')
+    args = parser.parse_args()
+    generate_tenant_data(args.count, args.output, args.seed)
\ No newline at end of file